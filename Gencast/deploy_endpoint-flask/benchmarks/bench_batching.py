@@ -0,0 +1,65 @@
+"""
+Throughput of GenCast forecasts at fixed hardware, one rollout per request vs several
+requests stacked along `batch` (`GenCastPredictor.predict_batch`).
+
+Requests are synthetic inputs with different init dates and rollout lengths. Every batch
+size is compiled by an untimed first run, then the whole request set is timed and the
+throughput is reported in requests per hour.
+
+    python benchmarks/bench_batching.py --checkpoint model/GenCast_1p0deg_2019.npz --requests 8 --batch-sizes 1 2 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+
+from synthetic_era5 import make_synthetic_model_inputs  # noqa: E402
+
+
+def make_requests(num_requests, min_steps, max_steps, resolution):
+    init_times = pd.date_range("2019-03-01", periods=num_requests, freq="36h")
+    return [
+        make_synthetic_model_inputs(str(init_time), nb_steps=min_steps + i % (max_steps - min_steps + 1),
+                                    resolution=resolution, seed=i)
+        for i, init_time in enumerate(init_times)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", required=True)
+    parser.add_argument("--resolution", type=float, default=1.0)
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--members", type=int, default=None, help="Ensemble size (default: the predictor's)")
+    parser.add_argument("--min-steps", type=int, default=7)
+    parser.add_argument("--max-steps", type=int, default=9)
+    args = parser.parse_args()
+
+    from graphcast import checkpoint, gencast
+    from resources import GenCastPredictor
+
+    with open(args.checkpoint, "rb") as f:
+        ckpt = checkpoint.load(f, gencast.CheckPoint)
+    predictor = GenCastPredictor(ckpt, resolution=args.resolution)
+    requests = make_requests(args.requests, args.min_steps, args.max_steps, args.resolution)
+
+    print(f"{'batch size':>10} | {'total (s)':>9} | {'requests/hour':>13}")
+    for batch_size in args.batch_sizes:
+        batches = [requests[i:i + batch_size] for i in range(0, len(requests), batch_size)]
+        # Compile the shapes of this batch size outside of the timing
+        predictor.predict_batch(batches[0], num_ensemble_members=args.members)
+
+        start = time.perf_counter()
+        for batch in batches:
+            predictor.predict_batch(batch, num_ensemble_members=args.members)
+        seconds = time.perf_counter() - start
+        print(f"{batch_size:>10} | {seconds:>9.1f} | {len(requests) * 3600 / seconds:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
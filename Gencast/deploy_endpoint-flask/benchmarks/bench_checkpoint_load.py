@@ -0,0 +1,110 @@
+"""
+Startup cost of loading the GenCast checkpoint from the `.npz` (read and decompressed in
+full) vs from a directory converted by `mmap_checkpoint.py` (memory-mapped).
+
+Every loader runs in a fresh child process, which reports the seconds and RSS once the
+checkpoint is loaded, then once every parameter has been read (what the first
+compilation does). With `--typed` the checkpoint is built as a `gencast.CheckPoint`
+(needs graphcast); otherwise the flat `key -> array` mappings are compared. Without a
+checkpoint, `--synthetic-mb` writes a fake one of that size.
+
+    python benchmarks/bench_checkpoint_load.py --checkpoint model/GenCast_1p0deg_2019.npz --typed
+    python benchmarks/bench_checkpoint_load.py --synthetic-mb 500
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model")
+sys.path.insert(0, MODEL_DIR)
+
+from mmap_checkpoint import convert_checkpoint, load_any_checkpoint, load_flat_checkpoint  # noqa: E402
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def write_synthetic_checkpoint(path, size_mb, array_mb=4):
+    rng = np.random.default_rng(0)
+    flat = {"description": np.array("synthetic checkpoint"), "task_config:input_duration": np.array("24h")}
+    for i in range(max(1, size_mb // array_mb)):
+        flat[f"params:layer_{i}/linear:w"] = rng.random(array_mb * 2 ** 18, dtype=np.float32).reshape(512, -1)
+    np.savez_compressed(path, **flat)
+
+
+def child(args):
+    start = time.perf_counter()
+    if args.typed:
+        from graphcast import gencast
+
+        ckpt = load_any_checkpoint(args.child, gencast.CheckPoint)
+        leaves = list(_leaves(ckpt.params))
+    elif os.path.isdir(args.child):
+        leaves = list(load_flat_checkpoint(args.child).values())
+    else:
+        with np.load(args.child, allow_pickle=False) as flat:
+            leaves = [flat[key] for key in flat.files]
+    loaded = time.perf_counter() - start, rss_mb()
+
+    for leaf in leaves:
+        leaf = np.asarray(leaf)
+        if leaf.dtype.kind in "fiub":
+            leaf.sum()
+    touched = time.perf_counter() - start, rss_mb()
+    print(json.dumps({"loaded": loaded, "touched": touched}))
+
+
+def _leaves(tree):
+    if isinstance(tree, dict):
+        for value in tree.values():
+            yield from _leaves(value)
+    else:
+        yield tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default=None, help="The .npz checkpoint")
+    parser.add_argument("--directory", default=None, help="Converted checkpoint (default: converted in a temp dir)")
+    parser.add_argument("--synthetic-mb", type=int, default=200)
+    parser.add_argument("--typed", action="store_true", help="Load as gencast.CheckPoint (needs graphcast)")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        return child(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        npz_path = args.checkpoint
+        if npz_path is None:
+            npz_path = os.path.join(tmp, "synthetic.npz")
+            write_synthetic_checkpoint(npz_path, args.synthetic_mb)
+        directory = args.directory
+        if directory is None:
+            directory = os.path.join(tmp, "converted")
+            start = time.perf_counter()
+            convert_checkpoint(npz_path, directory)
+            print(f">>> Converted in {time.perf_counter() - start:.1f} s")
+
+        print(f"{'loader':>6} | {'load (s)':>8} | {'RSS (MB)':>8} | {'all params read (s)':>19} | {'RSS (MB)':>8}")
+        for name, path in (("npz", npz_path), ("mmap", directory)):
+            command = [sys.executable, os.path.abspath(__file__), "--child", path] + (["--typed"] if args.typed else [])
+            output = subprocess.run(command, cwd=MODEL_DIR, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            (load_s, load_rss), (touch_s, touch_rss) = result["loaded"], result["touched"]
+            print(f"{name:>6} | {load_s:>8.2f} | {load_rss:>8.0f} | {touch_s:>19.2f} | {touch_rss:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Cold-start benchmark of the GenCast predictor with and without the compilation cache.
+
+Every scenario runs in a fresh Python process (like a new replica) which loads the
+checkpoint, builds the predictor and compiles the forward rollout on synthetic inputs:
+
+  - no cache:   compilation cache disabled, full XLA compilation;
+  - cold cache: empty cache directory, full compilation plus writing the executables;
+  - warm cache: same directory again, executables loaded from disk.
+
+    python benchmarks/bench_cold_start.py --checkpoint model/GenCast_1p0deg_2019.npz
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model")
+
+
+def child(args):
+    start = time.perf_counter()
+    sys.path.insert(0, MODEL_DIR)
+    from graphcast import checkpoint, gencast
+    from compilation_cache import checkpoint_hash, enable_compilation_cache, executable_key
+    from resources import GenCastPredictor
+    timings = {"import_s": time.perf_counter() - start}
+
+    if args.cache_dir:
+        key = executable_key(checkpoint_hash(args.checkpoint), args.resolution, args.ensemble)
+        enable_compilation_cache(key, args.cache_dir)
+
+    step = time.perf_counter()
+    with open(args.checkpoint, "rb") as f:
+        ckpt = checkpoint.load(f, gencast.CheckPoint)
+    predictor = GenCastPredictor(ckpt, resolution=args.resolution, num_ensemble_members=args.ensemble)
+    timings["build_s"] = time.perf_counter() - step
+
+    timings["warm_up_s"] = predictor.warm_up()
+    timings["total_s"] = time.perf_counter() - start
+    print("RESULT " + json.dumps(timings))
+
+
+def run_scenario(args, cache_dir):
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--checkpoint", args.checkpoint,
+               "--resolution", str(args.resolution), "--ensemble", str(args.ensemble),
+               "--cache-dir", cache_dir]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    line = next(line for line in output.splitlines() if line.startswith("RESULT "))
+    return json.loads(line[len("RESULT "):])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", required=True)
+    parser.add_argument("--resolution", type=float, default=1.0)
+    parser.add_argument("--ensemble", type=int, default=8)
+    parser.add_argument("--cache-dir", default="")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        scenarios = [("no cache", ""), ("cold cache", cache_dir), ("warm cache", cache_dir)]
+        print(f"{'scenario':>10} | {'import (s)':>10} | {'build (s)':>9} | {'compile (s)':>11} | {'total (s)':>9}")
+        for name, directory in scenarios:
+            timings = run_scenario(args, directory)
+            print(f"{name:>10} | {timings['import_s']:>10.1f} | {timings['build_s']:>9.1f} | "
+                  f"{timings['warm_up_s']:>11.1f} | {timings['total_s']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Scaling of the ensemble rollout on CPU with the number of host devices exposed to JAX
+(`cpu_devices.configure_cpu_devices`), from 1 device (the JAX default, members run one
+after another) to one device per core.
+
+XLA reads its flags once, so every device count is measured in a child process. By
+default the workload is synthetic: every member runs `--steps` steps of a chain of
+matmuls, pmapped over the devices one batch of members at a time, like
+`rollout.chunked_prediction_generator_multiple_runs`. With `--checkpoint`, the GenCast
+rollout itself is timed on synthetic inputs. Each child compiles with an untimed first
+run.
+
+    python benchmarks/bench_cpu_scaling.py --devices 1 2 4 8 --members 8
+    python benchmarks/bench_cpu_scaling.py --devices 1 2 4 8 --checkpoint model/GenCast_1p0deg_2019.npz
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model")
+sys.path.insert(0, MODEL_DIR)
+
+from cpu_devices import available_cores, configure_cpu_devices  # noqa: E402
+
+
+def synthetic_rollout(num_members, num_steps, size):
+    import jax
+    import jax.numpy as jnp
+
+    devices = jax.local_devices()
+    step = jax.pmap(lambda x: jnp.tanh(x @ x.T / size) @ x, devices=devices)
+    state = jnp.ones((num_members, size, size), dtype=jnp.float32)
+
+    def run():
+        for first in range(0, num_members, len(devices)):
+            x = state[first:first + len(devices)]
+            for _ in range(num_steps):
+                x = step(x)
+            x.block_until_ready()
+
+    return run
+
+
+def gencast_rollout(checkpoint_path, resolution, num_members, num_steps):
+    from graphcast import checkpoint, gencast
+    from resources import GenCastPredictor
+    from synthetic_era5 import make_synthetic_model_inputs
+
+    with open(checkpoint_path, "rb") as f:
+        ckpt = checkpoint.load(f, gencast.CheckPoint)
+    predictor = GenCastPredictor(ckpt, num_ensemble_members=num_members, resolution=resolution)
+    inputs = make_synthetic_model_inputs(nb_steps=num_steps, resolution=resolution)
+    eval_data = predictor.extract_eval_data(inputs)
+    return lambda: predictor.run_autoregression(*eval_data)
+
+
+def child(args):
+    configure_cpu_devices(args.child, threads_per_device=args.threads_per_device)
+    if args.checkpoint:
+        run = gencast_rollout(args.checkpoint, args.resolution, args.members, args.steps)
+    else:
+        run = synthetic_rollout(args.members, args.steps, args.size)
+    run()
+    start = time.perf_counter()
+    run()
+    print(json.dumps({"seconds": time.perf_counter() - start}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, nargs="+", default=None,
+                        help="Device counts to measure (default: powers of 2 up to the available cores)")
+    parser.add_argument("--threads-per-device", type=int, default=1)
+    parser.add_argument("--members", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--size", type=int, default=512, help="Matrix size of the synthetic workload")
+    parser.add_argument("--checkpoint", default=None, help="Time the GenCast rollout of this checkpoint")
+    parser.add_argument("--resolution", type=float, default=1.0)
+    parser.add_argument("--child", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        return child(args)
+
+    cores = available_cores()
+    devices = args.devices or [2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores]
+    print(f">>> {cores} cores available, {args.members} members, {args.steps} steps")
+
+    baseline = None
+    print(f"{'devices':>7} | {'seconds':>8} | {'speed-up':>8}")
+    for num_devices in devices:
+        if args.members % num_devices:
+            print(f"{num_devices:>7} | skipped, does not divide {args.members} members")
+            continue
+        command = [sys.executable, os.path.abspath(__file__), "--child", str(num_devices)] + sys.argv[1:]
+        env = {k: v for k, v in os.environ.items() if k not in ("XLA_FLAGS", "GENCAST_CPU_DEVICES")}
+        output = subprocess.run(command, env=env, cwd=MODEL_DIR, check=True, capture_output=True, text=True).stdout
+        seconds = json.loads(output.strip().splitlines()[-1])["seconds"]
+        baseline = seconds if baseline is None else baseline
+        print(f"{num_devices:>7} | {seconds:>8.2f} | {baseline / seconds:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Throughput benchmark of the ERA5 data-source backends.
+
+Reads the input slices of a series of init dates through each backend and reports
+slices per second and MB materialised per second. By default it runs fully offline
+against synthetic archives (a local Zarr store and a directory of NetCDF files);
+`--arco` and `--cds` add the remote backends (network and CDS credentials needed).
+
+    python benchmarks/bench_data_sources.py --inits 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+
+from data_sources import ARCOZarrSource, CDSSource, LocalArchiveSource  # noqa: E402
+from loading_API_data import load_era5_slice  # noqa: E402
+from synthetic_era5 import write_synthetic_era5, write_synthetic_era5_netcdf  # noqa: E402
+
+
+def run(source, init_times, resolution):
+    materialised = 0
+    start = time.perf_counter()
+    for init_time in init_times:
+        stats = {}
+        load_era5_slice(init_time.to_pydatetime(), resolution=resolution, source=source, read_stats=stats)
+        materialised += stats["bytes_materialised"]
+    elapsed = time.perf_counter() - start
+    return len(init_times) / elapsed, materialised / 1e6 / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inits", type=int, default=8, help="Number of 12-hourly init dates to read")
+    parser.add_argument("--start", default="2019-03-26")
+    parser.add_argument("--resolution", type=float, default=1.0)
+    parser.add_argument("--n-lat", type=int, default=181)
+    parser.add_argument("--n-lon", type=int, default=360)
+    parser.add_argument("--arco", action="store_true", help="Also benchmark the ARCO store on GCS")
+    parser.add_argument("--cds", action="store_true", help="Also benchmark the Copernicus CDS")
+    args = parser.parse_args()
+
+    init_times = pd.date_range(args.start, periods=args.inits, freq="12h")
+    stop = str((init_times[-1] + pd.Timedelta(days=1)).date())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        synthetic = dict(n_lat=args.n_lat, n_lon=args.n_lon)
+        zarr_path = write_synthetic_era5(os.path.join(tmp_dir, "era5.zarr"), args.start, stop, **synthetic)
+        netcdf_path = write_synthetic_era5_netcdf(os.path.join(tmp_dir, "era5_nc"), args.start, stop, **synthetic)
+
+        sources = {
+            "local zarr": LocalArchiveSource(zarr_path),
+            "local netcdf": LocalArchiveSource(netcdf_path),
+        }
+        if args.arco:
+            sources["arco"] = ARCOZarrSource()
+        if args.cds:
+            sources["cds"] = CDSSource(os.path.join(tmp_dir, "cds"))
+
+        print(f"{'backend':>12} | {'slices/s':>8} | {'MB/s':>8}")
+        for name, source in sources.items():
+            # Remote backends are read at their own dates, not the synthetic ones
+            times = init_times
+            if name in ("arco", "cds"):
+                times = pd.date_range("2019-03-26", periods=args.inits, freq="12h")
+            slices_per_s, mb_per_s = run(source, times, args.resolution)
+            print(f"{name:>12} | {slices_per_s:>8.2f} | {mb_per_s:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
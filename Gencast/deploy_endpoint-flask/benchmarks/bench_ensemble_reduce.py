@@ -0,0 +1,80 @@
+"""
+Benchmark of the ensemble reduction: combining every member before averaging (the
+former `run_autoregression`) vs the streaming reducer, optionally keeping only the last
+`--window` lead times (the output window of `GenCastPredictor.predict`).
+
+Synthetic prediction chunks with the shapes of the rollout output are generated one at
+a time, in the order of `rollout.chunked_prediction_generator_multiple_runs`, and the
+traced peak memory of each reduction is reported for growing ensemble sizes.
+
+    python benchmarks/bench_ensemble_reduce.py --members 2 4 8 16 --steps 8
+    python benchmarks/bench_ensemble_reduce.py --members 8 --steps 27 --window 7
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import xarray as xr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+
+from ensemble_stats import StreamingEnsembleReducer  # noqa: E402
+from memory_report import MemoryReport  # noqa: E402
+from synthetic_era5 import GENCAST_LEVELS, LEVEL_VARIABLES, SURFACE_VARIABLES  # noqa: E402
+
+
+def generate_chunks(num_members, num_steps, devices, n_lat, n_lon, seed=0):
+    """Yields one chunk per (device batch, lead time), like the rollout does."""
+    rng = np.random.default_rng(seed)
+    for first in range(0, num_members, devices):
+        samples = np.arange(first, first + devices)
+        for step in range(num_steps):
+            data_vars = {}
+            for var in SURFACE_VARIABLES:
+                data_vars[var] = (('sample', 'batch', 'time', 'lat', 'lon'),
+                                  rng.random((devices, 1, 1, n_lat, n_lon), dtype=np.float32))
+            for var in LEVEL_VARIABLES:
+                data_vars[var] = (('sample', 'batch', 'time', 'level', 'lat', 'lon'),
+                                  rng.random((devices, 1, 1, len(GENCAST_LEVELS), n_lat, n_lon), dtype=np.float32))
+            yield xr.Dataset(data_vars, coords={
+                'sample': samples,
+                'time': [np.timedelta64(12 * (step + 1), 'h').astype('timedelta64[ns]')],
+                'level': GENCAST_LEVELS,
+            })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, nargs="+", default=[2, 4, 8, 16])
+    parser.add_argument("--steps", type=int, default=8)
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--window", type=int, default=0, help="Also stream keeping only the last N lead times")
+    parser.add_argument("--n-lat", type=int, default=181)
+    parser.add_argument("--n-lon", type=int, default=360)
+    args = parser.parse_args()
+
+    report = MemoryReport("ensemble reduction")
+    for num_members in args.members:
+        chunks = lambda: generate_chunks(num_members, args.steps, args.devices, args.n_lat, args.n_lon)  # noqa: E731
+        with report.step(f"combine then mean, {num_members} members"):
+            xr.combine_by_coords(list(chunks())).mean(dim="sample")
+        with report.step(f"streaming, {num_members} members"):
+            reducer = StreamingEnsembleReducer()
+            for chunk in chunks():
+                reducer.update(chunk)
+            reducer.mean()
+        if args.window:
+            # Clamped to the rollout like `output_window`, for rollouts shorter than the window
+            num_lead_times = min(args.window, args.steps)
+            window = (np.timedelta64(12 * (args.steps - num_lead_times + 1), 'h'), np.timedelta64(12 * args.steps, 'h'))
+            with report.step(f"streaming, last {num_lead_times}, {num_members} members"):
+                reducer = StreamingEnsembleReducer(lead_time_window=window)
+                for chunk in chunks():
+                    reducer.update(chunk)
+                reducer.mean()
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
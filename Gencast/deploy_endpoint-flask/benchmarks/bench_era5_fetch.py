@@ -0,0 +1,85 @@
+"""
+Benchmark of sequential vs concurrent ERA5 chunk fetching.
+
+Reads the same two-frame input slice from a local stand-in for the ARCO store
+(a synthetic Zarr directory, or fsspec's in-memory filesystem) with increasing
+fetch concurrency. A per-chunk latency can be injected to mimic GCS round trips.
+
+    python benchmarks/bench_era5_fetch.py --latency-ms 50 --concurrency 1 4 16
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections.abc import MutableMapping
+from datetime import datetime
+
+import fsspec
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+
+from data_sources import ZarrDataSource  # noqa: E402
+from loading_API_data import load_era5_slice  # noqa: E402
+from synthetic_era5 import write_synthetic_era5  # noqa: E402
+
+
+class SlowStore(MutableMapping):
+    """Key-value store adding a fixed latency to every data chunk read."""
+
+    def __init__(self, store, latency_s):
+        self.store = store
+        self.latency_s = latency_s
+
+    def __getitem__(self, key):
+        if not key.rsplit("/", 1)[-1].startswith("."):
+            time.sleep(self.latency_s)
+        return self.store[key]
+
+    def __setitem__(self, key, value):
+        self.store[key] = value
+
+    def __delitem__(self, key):
+        del self.store[key]
+
+    def __contains__(self, key):
+        return key in self.store
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["local", "memory"], default="local")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--n-lat", type=int, default=181)
+    parser.add_argument("--n-lon", type=int, default=360)
+    args = parser.parse_args()
+
+    init_time = datetime(2019, 3, 29)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "era5.zarr") if args.backend == "local" else "memory://era5.zarr"
+        write_synthetic_era5(path, "2019-03-28", "2019-03-30", n_lat=args.n_lat, n_lon=args.n_lon)
+
+        print(f"{'concurrency':>11} | {'best (s)':>9} | {'chunks':>6} | {'MB read':>8}")
+        for concurrency in args.concurrency:
+            timings = []
+            for _ in range(args.repeats):
+                store = SlowStore(fsspec.get_mapper(path), args.latency_ms / 1000)
+                source = ZarrDataSource(store, location=path)
+                stats = {}
+                start = time.perf_counter()
+                load_era5_slice(init_time, source=source, read_stats=stats, concurrency=concurrency)
+                timings.append(time.perf_counter() - start)
+            print(f"{concurrency:>11} | {min(timings):>9.3f} | {stats['chunks_read']:>6} | "
+                  f"{stats['bytes_read'] / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Throughput of forecast jobs run one after the other (input assembly, then rollout, then
+output) vs through the staged pipeline (`pipeline.StagedExecutor`), where the inputs of
+the next job are assembled, and the previous output written, while a rollout runs.
+
+Inputs are assembled by `get_input_data` from a synthetic local ERA5 archive (the
+`local` data source), one init date per job. The rollout is a stand-in that keeps the
+device busy for `--rollout-seconds` (releasing the GIL, as XLA does), or the GenCast
+rollout with `--checkpoint`. Outputs are written as NetCDF to a temporary directory.
+
+    python benchmarks/bench_pipeline.py --jobs 8 --rollout-seconds 2
+    python benchmarks/bench_pipeline.py --jobs 4 --checkpoint model/GenCast_1p0deg_2019.npz
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+
+# Keep the input slices of the benchmark out of the server's cache
+os.environ.setdefault("ERA5_CACHE_DIR", os.path.join(tempfile.gettempdir(), f"bench_pipeline_{os.getpid()}"))
+
+from data_sources import LocalArchiveSource  # noqa: E402
+from loading_API_data import get_input_data  # noqa: E402
+from pipeline import Stage, StagedExecutor  # noqa: E402
+from synthetic_era5 import write_synthetic_era5  # noqa: E402
+
+
+def make_stages(source, resolution, rollout_seconds, predictor, output_dir):
+    def fetch(dates):
+        return get_input_data(*dates, source=source, resolution=resolution)
+
+    def rollout(inputs):
+        if predictor is not None:
+            return predictor.predict(inputs)
+        time.sleep(rollout_seconds)
+        return inputs.isel(time=slice(-7, None))
+
+    def output(prediction):
+        path = os.path.join(output_dir, f"{uuid.uuid4().hex}.nc")
+        prediction.to_netcdf(path)
+        return path
+
+    return [Stage("fetch", fetch), Stage("rollout", rollout), Stage("output", output)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--rollout-seconds", type=float, default=2.0)
+    parser.add_argument("--lead-days", type=int, default=2, help="Days between the init and target dates")
+    parser.add_argument("--queue-size", type=int, default=1)
+    parser.add_argument("--checkpoint", default=None, help="Run the GenCast rollout of this checkpoint")
+    parser.add_argument("--resolution", type=float, default=1.0)
+    parser.add_argument("--n-lat", type=int, default=181)
+    parser.add_argument("--n-lon", type=int, default=360)
+    args = parser.parse_args()
+
+    predictor = None
+    if args.checkpoint:
+        from inference import model_fn
+        from resources import GenCastPredictor
+
+        predictor = GenCastPredictor(model_fn(args.checkpoint), resolution=args.resolution)
+        predictor.warm_up()
+
+    init_dates = pd.date_range("2019-03-01", periods=2 * args.jobs, freq="D")
+    requests = [(str(date.date()), str((date + pd.Timedelta(days=args.lead_days)).date()))
+                for date in init_dates]
+    stop = str((init_dates[-1] + pd.Timedelta(days=1)).date())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archive = write_synthetic_era5(os.path.join(tmp_dir, "era5.zarr"), "2019-02-27", stop,
+                                       n_lat=args.n_lat, n_lon=args.n_lon, freq="12h")
+        source = LocalArchiveSource(archive)
+        stages = make_stages(source, args.resolution, args.rollout_seconds, predictor, tmp_dir)
+
+        # Distinct dates for each mode, so neither reads slices cached by the other
+        sequential_rollout = 0.0
+        start = time.perf_counter()
+        for dates in requests[:args.jobs]:
+            item = dates
+            for stage in stages:
+                stage_start = time.perf_counter()
+                item = stage.fn(item)
+                if stage.name == "rollout":
+                    sequential_rollout += time.perf_counter() - stage_start
+        sequential = time.perf_counter() - start
+
+        executor = StagedExecutor(stages, queue_size=args.queue_size).start()
+        start = time.perf_counter()
+        futures = [executor.submit(dates) for dates in requests[args.jobs:]]
+        for future in futures:
+            future.result()
+        pipelined = time.perf_counter() - start
+        busy = executor.stats()
+
+    print(f"{'mode':>10} | {'total (s)':>9} | {'jobs/hour':>9} | {'rollout busy':>12}")
+    for name, seconds, rollout in (("sequential", sequential, sequential_rollout),
+                                   ("pipelined", pipelined, busy["rollout"]["busy_seconds"])):
+        print(f"{name:>10} | {seconds:>9.1f} | {args.jobs * 3600 / seconds:>9.0f} | {rollout / seconds:>12.0%}")
+    print("pipelined, per job: " + ", ".join(f"{name} {stage['busy_seconds'] / args.jobs:.2f} s"
+                                             for name, stage in busy.items()))
+
+
+if __name__ == "__main__":
+    main()
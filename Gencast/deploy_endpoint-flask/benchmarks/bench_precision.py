@@ -0,0 +1,80 @@
+"""
+Accuracy vs speed of the reduced precision modes of `GenCastPredictor` (`--precision` /
+`GENCAST_PRECISION`) against the float32 baseline, on a fixed case.
+
+The case is an assembled input dataset saved as NetCDF (`--inputs`, e.g. the output of
+`get_input_data` written with `to_netcdf`), or synthetic inputs with a fixed seed. Every
+precision runs the same ensemble (same seed, so the same noise), compiled by an untimed
+first run. Reported: the params footprint, the rollout time and, per variable, the RMSE
+of the ensemble mean against float32, relative to the standard deviation of the float32
+field, and the largest absolute difference.
+
+    python benchmarks/bench_precision.py --checkpoint model/GenCast_1p0deg_2019.npz --members 2 --steps 4
+    python benchmarks/bench_precision.py --checkpoint model/GenCast_1p0deg_2019.npz --inputs case.nc
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import xarray as xr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+
+from synthetic_era5 import make_synthetic_model_inputs  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", required=True)
+    parser.add_argument("--resolution", type=float, default=1.0)
+    parser.add_argument("--precisions", nargs="+", default=["bfloat16"])
+    parser.add_argument("--inputs", default=None, help="NetCDF of assembled inputs (default: synthetic)")
+    parser.add_argument("--steps", type=int, default=4, help="Rollout steps of the synthetic case")
+    parser.add_argument("--members", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from graphcast import checkpoint, gencast
+    from resources import GenCastPredictor, params_nbytes
+
+    if args.inputs:
+        inputs = xr.load_dataset(args.inputs)
+    else:
+        inputs = make_synthetic_model_inputs(nb_steps=args.steps, resolution=args.resolution, seed=args.seed)
+
+    results = {}
+    for precision in ["float32"] + [p for p in args.precisions if p != "float32"]:
+        with open(args.checkpoint, "rb") as f:
+            ckpt = checkpoint.load(f, gencast.CheckPoint)
+        predictor = GenCastPredictor(ckpt, num_ensemble_members=args.members, resolution=args.resolution,
+                                     precision=precision)
+        del ckpt
+        run = lambda: predictor.run_ensemble(inputs, seed=args.seed).mean()  # noqa: E731
+        run()
+        start = time.perf_counter()
+        mean = run().compute()
+        results[precision] = (params_nbytes(predictor.params), time.perf_counter() - start, mean)
+        del predictor
+
+    baseline_bytes, baseline_seconds, baseline = results["float32"]
+    print(f"{'precision':>9} | {'params (MB)':>11} | {'rollout (s)':>11} | {'speed-up':>8}")
+    for precision, (nbytes, seconds, _) in results.items():
+        print(f"{precision:>9} | {nbytes / 2 ** 20:>11.1f} | {seconds:>11.1f} | {baseline_seconds / seconds:>7.2f}x")
+
+    for precision, (_, _, mean) in results.items():
+        if precision == "float32":
+            continue
+        print(f"\n{precision} vs float32, ensemble mean over all lead times")
+        print(f"{'variable':>30} | {'RMSE':>10} | {'RMSE / std':>10} | {'max |diff|':>10}")
+        for var in baseline.data_vars:
+            diff = (mean[var] - baseline[var]).values.astype(np.float64)
+            rmse = np.sqrt(np.nanmean(diff ** 2))
+            std = float(np.nanstd(baseline[var].values))
+            print(f"{var:>30} | {rmse:>10.4g} | {rmse / std if std else np.nan:>10.4g} | "
+                  f"{np.nanmax(np.abs(diff)):>10.4g}")
+
+
+if __name__ == "__main__":
+    main()
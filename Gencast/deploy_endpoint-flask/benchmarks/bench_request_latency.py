@@ -0,0 +1,66 @@
+"""
+Latency of the first and of later forecast requests, before and after loading the model
+at boot.
+
+"per request" reproduces the former `/invocations`: every request loads the checkpoint
+(`model_fn`), builds a predictor and runs the rollout, so every request pays the load
+and the XLA compilation. "boot" loads the predictor and runs its warm-up once (reported
+as the boot time, during which /ping is unhealthy), then serves the requests with it.
+Requests are synthetic inputs of `--steps` rollout steps.
+
+    python benchmarks/bench_request_latency.py --checkpoint model/GenCast_1p0deg_2019.npz --requests 3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+
+from synthetic_era5 import make_synthetic_model_inputs  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", required=True)
+    parser.add_argument("--resolution", type=float, default=1.0)
+    parser.add_argument("--requests", type=int, default=3)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--members", type=int, default=None, help="Ensemble size (default: the predictor's)")
+    args = parser.parse_args()
+
+    from inference import model_fn
+    from resources import GenCastPredictor
+
+    inputs = make_synthetic_model_inputs(nb_steps=args.steps, resolution=args.resolution)
+
+    def build():
+        predictor = GenCastPredictor(model_fn(args.checkpoint), resolution=args.resolution)
+        return predictor, (args.members or predictor.num_ensemble_members)
+
+    per_request = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        predictor, members = build()
+        predictor.predict(inputs, num_ensemble_members=members)
+        per_request.append(time.perf_counter() - start)
+        del predictor
+
+    start = time.perf_counter()
+    predictor, members = build()
+    predictor.warm_up()
+    boot_seconds = time.perf_counter() - start
+    at_boot = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        predictor.predict(inputs, num_ensemble_members=members)
+        at_boot.append(time.perf_counter() - start)
+
+    print(f"{'model loaded':>12} | {'boot (s)':>8} | " + " | ".join(f"{f'request {i + 1} (s)':>13}"
+                                                           for i in range(args.requests)))
+    for name, boot, latencies in (("per request", 0.0, per_request), ("at boot", boot_seconds, at_boot)):
+        print(f"{name:>12} | {boot:>8.1f} | " + " | ".join(f"{seconds:>13.1f}" for seconds in latencies))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Request coalescing (`single_flight.SingleFlight`, used by `/invocations`): concurrency
+check and per-request cost.
+
+`--threads` requests for the same key arrive together while a slow forecast (a sleep of
+`--work-seconds`) is in flight; the check fails unless the forecast ran once and every
+request got the same result. Requests for distinct keys must all run. The cost of `do`
+is then measured on uncontended keys, in microseconds per request.
+
+    python benchmarks/bench_single_flight.py --threads 16 --work-seconds 0.5
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+
+from single_flight import SingleFlight  # noqa: E402
+
+
+def check_coalescing(num_threads, work_seconds):
+    flights = SingleFlight()
+    calls = []
+    barrier = threading.Barrier(num_threads)
+
+    def forecast(key):
+        calls.append(key)
+        time.sleep(work_seconds)
+        return object()
+
+    def request(key):
+        barrier.wait()
+        return flights.do(key, lambda: forecast(key))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(num_threads) as pool:
+        results = list(pool.map(request, ["same"] * num_threads))
+    seconds = time.perf_counter() - start
+    assert len(calls) == 1, f"the forecast ran {len(calls)} times"
+    assert all(result is results[0] for result in results), "requests got different results"
+    assert flights.coalesced == num_threads - 1 and flights.in_flight() == 0
+    print(f">>> Same key: {num_threads} requests, 1 forecast, {seconds:.2f} s (one forecast takes {work_seconds} s)")
+
+    calls.clear()
+    barrier = threading.Barrier(num_threads)
+    with ThreadPoolExecutor(num_threads) as pool:
+        results = list(pool.map(request, [f"key-{i}" for i in range(num_threads)]))
+    assert len(calls) == num_threads and len({id(result) for result in results}) == num_threads
+    print(f">>> Distinct keys: {num_threads} requests, {num_threads} forecasts")
+
+    # A failing forecast fails its waiters, and the next request runs it again
+    try:
+        flights.do("failing", lambda: 1 / 0)
+    except ZeroDivisionError:
+        pass
+    assert flights.do("failing", lambda: "ok") == "ok"
+    print(">>> Failure propagated, key released")
+
+
+def measure_overhead(num_calls):
+    flights = SingleFlight()
+    start = time.perf_counter()
+    for i in range(num_calls):
+        flights.do(i, lambda: None)
+    return (time.perf_counter() - start) / num_calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--work-seconds", type=float, default=0.5)
+    parser.add_argument("--calls", type=int, default=100000)
+    args = parser.parse_args()
+
+    check_coalescing(args.threads, args.work_seconds)
+    print(f">>> Overhead: {measure_overhead(args.calls):.2f} us per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Micro-benchmark of the NaN target template built by `create_target_data`.
+
+Compares the previous per-step implementation (one NaN copy of the full state per
+lead time, then `xr.concat`) with the broadcast builder, on a 1 degree input of the
+shape served by the endpoint. Each implementation runs in a fresh subprocess so the
+reported peak RSS is its own.
+
+    python benchmarks/bench_target_template.py --steps 30
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model"))
+
+from loading_API_data import create_target_data  # noqa: E402
+from synthetic_era5 import LEVEL_VARIABLES, STATIC_VARIABLES, SURFACE_VARIABLES  # noqa: E402
+
+
+def make_input(n_lat=181, n_lon=360, n_levels=13):
+    """Builds an input dataset shaped like the output of `get_input_data` steps 1-3."""
+    rng = np.random.default_rng(0)
+    coords = {
+        "batch": [0],
+        "time": pd.to_timedelta([-12, 0], unit="h"),
+        "level": np.arange(n_levels),
+        "lat": np.linspace(-90, 90, n_lat, dtype=np.float32),
+        "lon": np.linspace(0, 360, n_lon, endpoint=False, dtype=np.float32),
+    }
+    data_vars = {var: (("lat", "lon"), rng.random((n_lat, n_lon), dtype=np.float32))
+                 for var in STATIC_VARIABLES}
+    for var in SURFACE_VARIABLES + ["total_precipitation_12hr"]:
+        data_vars[var] = (("batch", "time", "lat", "lon"),
+                          rng.random((1, 2, n_lat, n_lon), dtype=np.float32))
+    for var in LEVEL_VARIABLES:
+        data_vars[var] = (("batch", "time", "level", "lat", "lon"),
+                          rng.random((1, 2, n_levels, n_lat, n_lon), dtype=np.float32))
+    ds = xr.Dataset(data_vars, coords=coords)
+    datetimes = np.array(["2019-03-29T00", "2019-03-29T12"], dtype="datetime64[ns]").reshape(1, 2)
+    return ds.assign_coords(datetime=(("batch", "time"), datetimes))
+
+
+def legacy_create_target_data(input_1, nb_of_steps_to_perform):
+    """The previous implementation of `create_target_data`, kept for comparison."""
+    step_ns = 43_200_000_000_000
+    target_times = np.arange(step_ns, step_ns * (nb_of_steps_to_perform + 1), step_ns)
+    target_time_coords = pd.to_timedelta(target_times, unit="ns")
+    last_datetime = np.array(input_1.coords["datetime"].values).flatten()[1]
+    step = pd.to_timedelta(step_ns, unit="ns")
+    target_datetime_coords = pd.date_range(start=last_datetime + step, periods=nb_of_steps_to_perform, freq=step)
+    template = input_1.isel(time=-1).drop_vars("time")
+    eval_targets_test = xr.concat(
+        [template.expand_dims(time=[t]) * np.nan for t in target_time_coords], dim="time")
+    return eval_targets_test.assign_coords({
+        "time": target_time_coords,
+        "datetime": ("time", target_datetime_coords),
+    })
+
+
+IMPLEMENTATIONS = {"legacy": legacy_create_target_data, "broadcast": create_target_data}
+
+
+def run_child(impl, steps):
+    input_1 = make_input()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = time.perf_counter()
+    targets = IMPLEMENTATIONS[impl](input_1, steps)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    state_bytes = input_1.drop_vars(STATIC_VARIABLES).isel(time=-1).nbytes
+    print(json.dumps({
+        "impl": impl,
+        "seconds": elapsed,
+        "traced_peak_mb": peak / 1e6,
+        "state_copies": peak / state_bytes,
+        "peak_rss_growth_mb": (rss_after - rss_before) / 1e3,
+        "result_dtype": str(targets["temperature"].dtype),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--child", choices=sorted(IMPLEMENTATIONS))
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.steps)
+        return
+
+    print(f"{'impl':>10} | {'time (s)':>8} | {'traced peak (MB)':>16} | {'state copies':>12} | "
+          f"{'RSS growth (MB)':>15} | dtype")
+    for impl in ("legacy", "broadcast"):
+        out = subprocess.run([sys.executable, __file__, "--child", impl, "--steps", str(args.steps)],
+                             check=True, capture_output=True, text=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{impl:>10} | {r['seconds']:>8.3f} | {r['traced_peak_mb']:>16.1f} | {r['state_copies']:>12.1f} | "
+              f"{r['peak_rss_growth_mb']:>15.1f} | {r['result_dtype']}")
+
+
+if __name__ == "__main__":
+    main()
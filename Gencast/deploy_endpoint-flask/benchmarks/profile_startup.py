@@ -0,0 +1,83 @@
+"""
+Startup profile of the serving modules: import time and resident memory.
+
+Each module is imported in a fresh Python process, which reports the wall time of the
+import and the RSS before and after it, plus the slowest imports seen by
+`python -X importtime`. `inference` is what the server pays before answering /ping;
+`resources` (JAX, haiku, graphcast) is deferred to the first prediction.
+
+Exits with status 1 when importing `inference` exceeds the import-time budget.
+
+    python benchmarks/profile_startup.py --budget-s 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model")
+
+CHILD = """
+import importlib, json, sys, time
+sys.path.insert(0, {model_dir!r})
+from memory_report import current_rss_mb
+rss_before = current_rss_mb()
+start = time.perf_counter()
+importlib.import_module({module!r})
+print("RESULT " + json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "rss_before_mb": rss_before,
+    "rss_after_mb": current_rss_mb(),
+}}))
+"""
+
+
+def profile(module, top):
+    command = [sys.executable, "-X", "importtime", "-c", CHILD.format(model_dir=MODEL_DIR, module=module)]
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=MODEL_DIR)
+    if completed.returncode != 0:
+        return None, completed.stderr.strip().splitlines()[-1]
+    line = next(line for line in completed.stdout.splitlines() if line.startswith("RESULT "))
+    result = json.loads(line[len("RESULT "):])
+
+    # "import time: self [us] | cumulative | imported package" lines, top-level packages only
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        if not name.startswith("  ") and name.strip() == name.strip().split(".")[0]:
+            cumulative[name.strip()] = int(parts[1]) / 1e6
+    result["slowest"] = sorted(cumulative.items(), key=lambda item: -item[1])[:top]
+    return result, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=["inference", "resources"])
+    parser.add_argument("--budget-s", type=float, default=float(os.environ.get("GENCAST_IMPORT_BUDGET_SECONDS", 5)))
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':>12} | {'import (s)':>10} | {'RSS before (MB)':>15} | {'RSS after (MB)':>14} | slowest imports")
+    over_budget = False
+    for module in args.modules:
+        result, error = profile(module, args.top)
+        if result is None:
+            print(f"{module:>12} | import failed: {error}")
+            continue
+        slowest = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result["slowest"])
+        print(f"{module:>12} | {result['seconds']:>10.2f} | {result['rss_before_mb']:>15.1f} | "
+              f"{result['rss_after_mb']:>14.1f} | {slowest}")
+        if module == "inference" and result["seconds"] > args.budget_s:
+            over_budget = True
+
+    if over_budget:
+        print(f">>> importing inference exceeds the {args.budget_s:.1f} s budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import xarray as xr
+
+# Largest number of requests rolled out together (1 disables batching)
+MAX_BATCH_SIZE = int(os.environ.get("GENCAST_MAX_BATCH_SIZE", 1))
+
+# Seconds the first queued request waits for others to join its batch
+BATCH_WAIT_SECONDS = float(os.environ.get("GENCAST_BATCH_WAIT_SECONDS", 2.0))
+
+
+def stack_inputs(inputs_list) -> xr.Dataset:
+    """
+    Stacks the assembled inputs of several requests (see `get_input_data`) along `batch`.
+
+    The target templates are padded with NaN steps to the longest request, and the
+    `datetime` coordinate of every request is extended over the padded steps, so the
+    forcings stay defined. The static fields, identical for every request of a given
+    resolution, are kept once.
+
+    Parameters:
+    - inputs_list (list of xr.Dataset): Inputs of the requests, each with a batch of 1.
+
+    Returns:
+    - xr.Dataset: The stacked inputs, request i at `batch=i`.
+    """
+    times = inputs_list[0].indexes['time']
+    for inputs in inputs_list[1:]:
+        times = times.union(inputs.indexes['time'])
+    offsets = (times - times[0]).to_numpy()
+
+    padded = []
+    for inputs in inputs_list:
+        inputs = inputs.reindex(time=times)
+        start = inputs['datetime'].values[0, 0]
+        inputs = inputs.assign_coords(datetime=(('batch', 'time'), (start + offsets).reshape(1, -1)))
+        padded.append(inputs.drop_vars('batch', errors='ignore'))
+
+    stacked = xr.concat(padded, dim='batch', data_vars='minimal', coords='minimal', compat='override')
+    return stacked.assign_coords(batch=np.arange(len(inputs_list)))
+
+
+class RequestBatcher:
+    """
+    Collects concurrent forecast requests and rolls them out together.
+
+    The first request of a batch waits up to `max_wait` seconds for others; requests
+    sharing the same rollout options (ensemble size, chunking, seed) are then stacked
+    along `batch` and run in a single rollout (see `GenCastPredictor.predict_batch`),
+    and every request gets its own forecast back.
+
+    Parameters:
+    - predictor (GenCastPredictor): The model.
+    - max_batch_size (int): Largest number of requests per rollout.
+    - max_wait (float): Seconds the first request waits for the batch to fill.
+
+    Usage:
+        batcher = RequestBatcher(predictor).start()
+        prediction = batcher.submit(inputs, plan.predict_options()).result()
+    """
+
+    def __init__(self, predictor, max_batch_size: int = MAX_BATCH_SIZE, max_wait: float = BATCH_WAIT_SECONDS):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self.batch_sizes = []
+
+    def submit(self, inputs: xr.Dataset, predict_options: dict = None) -> Future:
+        """Queues a request, the returned future resolves to its processed forecast."""
+        future = Future()
+        self._queue.put((inputs, predict_options or {}, future))
+        return future
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run_once(self):
+        """Collects one batch and rolls it out, one rollout per set of options."""
+        groups = {}
+        for inputs, options, future in self._collect():
+            groups.setdefault(tuple(sorted(options.items())), []).append((inputs, future))
+
+        for options, requests in groups.items():
+            futures = [future for _, future in requests]
+            try:
+                predictions = self.predictor.predict_batch([inputs for inputs, _ in requests], **dict(options))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batch_sizes.append(len(requests))
+            for future, prediction in zip(futures, predictions):
+                future.set_result(prediction)
+
+    def _run(self):
+        while True:
+            self.run_once()
+
+    def start(self):
+        """Starts the batching thread (a daemon)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="gencast-batcher", daemon=True)
+            self._thread.start()
+        return self
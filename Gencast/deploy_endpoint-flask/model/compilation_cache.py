@@ -0,0 +1,139 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+from disk_cache import DiskLRUCache
+from mmap_checkpoint import is_mmap_checkpoint, read_index
+
+# JAX is imported on first use, so the CLI can expose the host devices first (see `cpu_devices`)
+
+# Set to 1 to load (and persist) compiled XLA executables from disk at startup
+COMPILATION_CACHE_ENABLED = os.environ.get("GENCAST_COMPILATION_CACHE", "0") == "1"
+
+# Root directory of the persisted executables, one subdirectory per executable key.
+# Point it to a volume shared by the replicas (e.g. EFS) so new replicas skip compilation.
+COMPILATION_CACHE_DIR = os.environ.get("GENCAST_COMPILATION_CACHE_DIR", "/opt/ml/cache/jax")
+
+_checkpoint_hashes = {}
+
+
+def checkpoint_hash(path: str) -> str:
+    """
+    SHA-256 of a checkpoint file, computed once per process (and file version). A
+    converted checkpoint directory (see `mmap_checkpoint`) has the hash of its source.
+    """
+    if is_mmap_checkpoint(path):
+        return read_index(path)["sha256"]
+    stat = os.stat(path)
+    version = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if version not in _checkpoint_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _checkpoint_hashes[version] = digest.hexdigest()
+    return _checkpoint_hashes[version]
+
+
+def executable_key(checkpoint_digest: str, resolution: float, num_ensemble_members: int,
+                   precision: str = "float32") -> str:
+    """
+    Key of the compiled executables of a model: the checkpoint, the grid and ensemble
+    size (which fix the served shapes), the precision of the denoiser, and the devices
+    and JAX version they run on.
+    """
+    import jax
+
+    devices = jax.local_devices()
+    return DiskLRUCache.make_key(
+        checkpoint=checkpoint_digest,
+        resolution=float(resolution),
+        ensemble=int(num_ensemble_members),
+        precision=precision,
+        platform=devices[0].platform,
+        device_kind=devices[0].device_kind,
+        device_count=len(devices),
+        jax=jax.__version__,
+    )
+
+
+def enable_compilation_cache(key: str, cache_dir: str = COMPILATION_CACHE_DIR) -> str:
+    """
+    Enables the persistent JAX compilation cache in the directory of `key`. Every
+    executable compiled afterwards is written there and loaded back, instead of being
+    recompiled, by any later process using the same key.
+
+    Must be called before the first compilation of the process.
+
+    Returns:
+    - str: The cache directory of `key`.
+    """
+    import jax
+
+    directory = os.path.join(cache_dir, key[:16])
+    os.makedirs(directory, exist_ok=True)
+    jax.config.update("jax_compilation_cache_dir", directory)
+    # Persist every executable, however fast it compiled
+    jax.config.update("jax_persistent_cache_min_compile_time_secs", 0)
+    jax.config.update("jax_persistent_cache_min_entry_size_bytes", -1)
+    print(f">>> JAX compilation cache enabled in {directory}")
+    return directory
+
+
+def manifest_path(directory: str) -> str:
+    return os.path.join(directory, "manifest.json")
+
+
+def export_executables(predictor, key: str, directory: str) -> dict:
+    """
+    Compiles the forward rollout of `predictor` ahead of time for the shapes it serves
+    (see `GenCastPredictor.warm_up`), with the compilation cache enabled in `directory`,
+    and records what was exported in a manifest next to the executables.
+
+    Returns:
+    - dict: The manifest.
+    """
+    import jax
+
+    seconds = predictor.warm_up()
+    manifest = {
+        "key": key,
+        "resolution": predictor.resolution,
+        "ensemble": predictor.num_ensemble_members,
+        "devices": [str(device) for device in jax.local_devices()],
+        "jax": jax.__version__,
+        "compile_seconds": seconds,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(manifest_path(directory), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == "__main__":
+    from cpu_devices import configure_from_env
+
+    configure_from_env()
+    from graphcast import gencast
+    from mmap_checkpoint import load_any_checkpoint
+    from resources import GenCastPredictor, NUM_ENSEMBLE_MEMBERS, PRECISION, PRECISIONS
+
+    parser = argparse.ArgumentParser(
+        description="Compile the GenCast forward rollout ahead of time into the compilation cache.")
+    parser.add_argument("--checkpoint", default="/opt/ml/model/GenCast_1p0deg_2019.npz",
+                        help="The .npz, or a directory converted by mmap_checkpoint.py")
+    parser.add_argument("--resolution", type=float, default=1.0)
+    parser.add_argument("--ensemble", type=int, default=NUM_ENSEMBLE_MEMBERS)
+    parser.add_argument("--precision", default=PRECISION, choices=sorted(PRECISIONS))
+    parser.add_argument("--cache-dir", default=COMPILATION_CACHE_DIR)
+    args = parser.parse_args()
+
+    key = executable_key(checkpoint_hash(args.checkpoint), args.resolution, args.ensemble, args.precision)
+    directory = enable_compilation_cache(key, args.cache_dir)
+    ckpt = load_any_checkpoint(args.checkpoint, gencast.CheckPoint)
+    predictor = GenCastPredictor(ckpt, resolution=args.resolution, num_ensemble_members=args.ensemble,
+                                 precision=args.precision)
+    manifest = export_executables(predictor, key, directory)
+    print(f">>> Exported executables in {manifest['compile_seconds']:.1f} s to {directory}")
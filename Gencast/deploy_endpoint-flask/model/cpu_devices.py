@@ -0,0 +1,64 @@
+import os
+import re
+import sys
+
+# Number of host devices exposed to JAX on CPU-only instances: 0 leaves JAX defaults
+# (a single CPU device), "auto" uses one device per `GENCAST_CPU_THREADS_PER_DEVICE` cores
+CPU_DEVICES = os.environ.get("GENCAST_CPU_DEVICES", "0")
+
+# Cores given to each host device
+CPU_THREADS_PER_DEVICE = int(os.environ.get("GENCAST_CPU_THREADS_PER_DEVICE", 1))
+
+
+def available_cores() -> int:
+    """Number of cores the process may run on (its CPU affinity, not the host total)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def configure_cpu_devices(num_devices: int = None, threads_per_device: int = CPU_THREADS_PER_DEVICE) -> int:
+    """
+    Exposes `num_devices` host devices to JAX, so that `xarray_jax.pmap` (and thus the
+    ensemble rollout) spreads the members across cores instead of running them one after
+    another on the single default CPU device.
+
+    With one thread per device, XLA's shared Eigen thread pool is disabled and every device
+    runs its computations on its own thread; otherwise the devices share a pool of
+    `num_devices * threads_per_device` threads.
+
+    Must be called before jax is imported, XLA reads its flags once.
+
+    Parameters:
+    - num_devices (int, optional): Number of host devices, defaults to the available
+      cores divided by `threads_per_device`.
+    - threads_per_device (int): Cores given to each device.
+
+    Returns:
+    - int: The number of host devices.
+    """
+    if "jax" in sys.modules:
+        raise RuntimeError("configure_cpu_devices must be called before jax is imported")
+    if num_devices is None:
+        num_devices = max(1, available_cores() // threads_per_device)
+
+    # Replace any device count or threading flag already set
+    flags = os.environ.get("XLA_FLAGS", "")
+    flags = re.sub(r"--xla_force_host_platform_device_count=\S+", "", flags)
+    flags = re.sub(r"--xla_cpu_multi_thread_eigen=\S+", "", flags)
+    flags += f" --xla_force_host_platform_device_count={num_devices}"
+    if threads_per_device == 1:
+        flags += " --xla_cpu_multi_thread_eigen=false"
+    os.environ["XLA_FLAGS"] = " ".join(flags.split())
+    os.environ.setdefault("JAX_PLATFORMS", "cpu")
+    print(f">>> CPU mode: {num_devices} host devices, {threads_per_device} thread(s) per device")
+    return num_devices
+
+
+def configure_from_env():
+    """Applies `GENCAST_CPU_DEVICES` / `GENCAST_CPU_THREADS_PER_DEVICE`, if set."""
+    if CPU_DEVICES == "0":
+        return None
+    num_devices = None if CPU_DEVICES == "auto" else int(CPU_DEVICES)
+    return configure_cpu_devices(num_devices, CPU_THREADS_PER_DEVICE)
@@ -0,0 +1,357 @@
+import glob
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from era5_store import (ARCO_ERA5_STORE, NATIVE_RESOLUTION, TimeAvailabilityIndex, count_reads,
+                        get_store_manager, load_concurrently)
+
+# Backend used when none is given explicitly: 'arco', 'local' or 'cds'
+DATA_SOURCE = os.environ.get("ERA5_DATA_SOURCE", "arco")
+
+# Store URL (arco) or archive directory (local) of the configured backend
+DATA_PATH = os.environ.get("ERA5_DATA_PATH")
+
+# Directory where the CDS backend downloads its NetCDF files
+CDS_DOWNLOAD_DIR = os.environ.get("ERA5_CDS_DOWNLOAD_DIR", os.path.join(tempfile.gettempdir(), "era5_cds"))
+
+
+class ERA5DataSource(ABC):
+    """
+    Interface of an ERA5 backend. Every backend returns data in the layout of the
+    ARCO store: variables named as in ARCO, dims `time`, `level`, `latitude`
+    (descending) and `longitude`, on a grid strided from the native 0.25 degree grid.
+    """
+
+    name = "base"
+
+    @property
+    @abstractmethod
+    def cache_id(self) -> str:
+        """Stable identifier of the backend and its location, used in cache keys."""
+
+    @abstractmethod
+    def availability(self) -> TimeAvailabilityIndex:
+        """Returns the availability index of the hourly frames."""
+
+    @abstractmethod
+    def read_frames(self, times, variables, levels, resolution, concurrency=1):
+        """
+        Reads and materialises the given frames.
+
+        Parameters:
+        - times (pd.DatetimeIndex): Frames to read, all available.
+        - variables (list): Variables to read.
+        - levels (list): Pressure levels to read.
+        - resolution (float): Output grid spacing in degrees, a multiple of 0.25.
+        - concurrency (int): Number of reads in flight at once, where supported.
+
+        Returns:
+        - ds (xr.Dataset): The frames, loaded in memory.
+        - stats (dict): `bytes_read` and `chunks_read` of the read (0 when unknown).
+        """
+
+    @abstractmethod
+    def read_static(self, variables) -> xr.Dataset:
+        """Reads the static fields at native resolution, without a time dimension."""
+
+    def refresh(self) -> bool:
+        """Refreshes the availability metadata. Returns True if new frames appeared."""
+        return False
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.cache_id!r})"
+
+
+def store_location(store):
+    """
+    Returns the URL or path of a Zarr store given as a string or as a key-value store
+    exposing it (fsspec mapper, Zarr directory or fsspec store), or None.
+    """
+    if isinstance(store, (str, os.PathLike)):
+        return os.fspath(store)
+    for attribute in ('root', 'path', 'url'):
+        location = getattr(store, attribute, None)
+        if isinstance(location, (str, os.PathLike)) and os.fspath(location):
+            location = os.fspath(location)
+            protocol = getattr(getattr(store, 'fs', None), 'protocol', None)
+            protocol = protocol[0] if isinstance(protocol, (tuple, list)) else protocol
+            if protocol and protocol not in ('file', 'local') and '://' not in location:
+                location = f"{protocol}://{location}"
+            return location
+    return None
+
+
+class ZarrDataSource(ERA5DataSource):
+    """
+    Backend reading an ERA5 Zarr store in the ARCO layout, through the process-wide
+    store handle (see `ERA5StoreManager`).
+
+    Parameters:
+    - store (str or MutableMapping): URL or path of the store, or a key-value store.
+    - location (str, optional): URL or path identifying the store in the cache keys,
+      required for key-value stores that do not expose theirs (see `store_location`).
+    """
+
+    name = "zarr"
+
+    def __init__(self, store, location: str = None):
+        self.store = store
+        self.location = location or store_location(store)
+        if not self.location:
+            raise ValueError(f"Cannot tell the location of the Zarr store {store!r}, pass it as `location`.")
+        self.manager = get_store_manager(store)
+
+    @property
+    def cache_id(self) -> str:
+        return f"{self.name}:{self.location}"
+
+    def availability(self) -> TimeAvailabilityIndex:
+        return self.manager.availability
+
+    def refresh(self) -> bool:
+        return self.manager.refresh()
+
+    def read_frames(self, times, variables, levels, resolution, concurrency=1):
+        # Reuse the process-wide lazily opened dataset, no data chunk is read yet
+        ds, _ = self.manager.open()
+
+        # Select the variables, time steps and pressure levels, then stride the grid
+        stride = int(round(resolution / NATIVE_RESOLUTION))
+        ds = ds[variables].sel(time=times, level=levels)
+        ds = ds.isel(latitude=slice(None, None, stride), longitude=slice(None, None, stride))
+
+        # Compute the selection (load into memory), fetching chunks in parallel
+        with count_reads() as counter:
+            ds = load_concurrently(ds, concurrency)
+        return ds, counter.stats()
+
+    def read_static(self, variables) -> xr.Dataset:
+        # The fields are constant, any single frame will do
+        first_time = self.availability().first_time
+        return self.manager.dataset[variables].sel(time=first_time).drop_vars('time').compute()
+
+
+class ARCOZarrSource(ZarrDataSource):
+    """Backend reading the public ARCO ERA5 store on GCS (or a mirror of it)."""
+
+    name = "arco"
+
+    def __init__(self, store=ARCO_ERA5_STORE):
+        super().__init__(store)
+
+
+class LocalArchiveSource(ERA5DataSource):
+    """
+    Backend reading a local ERA5 archive directory: either a Zarr store in the ARCO
+    layout (e.g. a regional mirror) or a directory of NetCDF files in the same layout
+    (e.g. a synthetic archive for offline CI). NetCDF archives are opened once and
+    kept open; their availability comes from the time coordinate.
+
+    Parameters:
+    - path (str): Archive directory.
+    """
+
+    name = "local"
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._zarr = None
+        self._ds = None
+        self._availability = None
+        self._lock = threading.Lock()
+        if any(os.path.exists(os.path.join(self.path, key)) for key in ('.zmetadata', '.zgroup')):
+            self._zarr = ZarrDataSource(self.path)
+
+    @property
+    def cache_id(self) -> str:
+        return f"{self.name}:{self.path}"
+
+    def _open(self):
+        with self._lock:
+            if self._ds is None:
+                files = sorted(glob.glob(os.path.join(self.path, "*.nc")))
+                if not files:
+                    raise FileNotFoundError(f"No Zarr store or NetCDF files found in {self.path}")
+                ds = xr.open_mfdataset(files, combine='by_coords', chunks={'time': 1})
+                times = ds.indexes['time']
+                attrs = ds.attrs
+                self._availability = TimeAvailabilityIndex.from_time_coordinate(
+                    times.values,
+                    attrs.get('valid_time_start', str(times[0].date())),
+                    attrs.get('valid_time_stop_era5t', attrs.get('valid_time_stop', str(times[-1].date()))),
+                )
+                self._ds = ds
+            return self._ds
+
+    def availability(self) -> TimeAvailabilityIndex:
+        if self._zarr is not None:
+            return self._zarr.availability()
+        self._open()
+        return self._availability
+
+    def refresh(self) -> bool:
+        return self._zarr.refresh() if self._zarr is not None else False
+
+    def read_frames(self, times, variables, levels, resolution, concurrency=1):
+        if self._zarr is not None:
+            return self._zarr.read_frames(times, variables, levels, resolution, concurrency)
+
+        stride = int(round(resolution / NATIVE_RESOLUTION))
+        ds = self._open()[variables].sel(time=times, level=levels)
+        ds = ds.isel(latitude=slice(None, None, stride), longitude=slice(None, None, stride))
+        ds = ds.compute(scheduler='threads', num_workers=max(1, concurrency))
+        return ds, {'bytes_read': 0, 'chunks_read': 0}
+
+    def read_static(self, variables) -> xr.Dataset:
+        if self._zarr is not None:
+            return self._zarr.read_static(variables)
+        first_time = self.availability().first_time
+        return self._open()[variables].sel(time=first_time).drop_vars('time').compute()
+
+
+class CDSSource(ERA5DataSource):
+    """
+    Backend downloading ERA5 from the Copernicus Climate Data Store with `cdsapi`
+    (credentials from `~/.cdsapirc` or the `CDSAPI_URL`/`CDSAPI_KEY` variables).
+    Frames are requested on the target grid directly, then renamed to the ARCO layout.
+
+    Parameters:
+    - download_dir (str): Directory of the downloaded NetCDF files.
+    - lag_days (int): Days behind real time considered available (ERA5T lag).
+    """
+
+    name = "cds"
+
+    # NetCDF short names returned by the CDS for the variables requested by ARCO name
+    SHORT_NAMES = {
+        '2m_temperature': 't2m', 'sea_surface_temperature': 'sst', 'mean_sea_level_pressure': 'msl',
+        '10m_v_component_of_wind': 'v10', '10m_u_component_of_wind': 'u10',
+        'u_component_of_wind': 'u', 'specific_humidity': 'q', 'temperature': 't',
+        'vertical_velocity': 'w', 'v_component_of_wind': 'v', 'geopotential': 'z',
+        'land_sea_mask': 'lsm', 'geopotential_at_surface': 'z',
+    }
+    # Variables requested from the CDS under another name
+    REQUEST_NAMES = {'geopotential_at_surface': 'geopotential'}
+    PRESSURE_LEVEL_VARIABLES = {
+        'u_component_of_wind', 'specific_humidity', 'temperature',
+        'vertical_velocity', 'v_component_of_wind', 'geopotential',
+    }
+
+    def __init__(self, download_dir: str = CDS_DOWNLOAD_DIR, lag_days: int = 6):
+        self.download_dir = download_dir
+        self.lag_days = lag_days
+
+    @property
+    def cache_id(self) -> str:
+        return self.name
+
+    def availability(self) -> TimeAvailabilityIndex:
+        last = pd.Timestamp.today().normalize() - pd.Timedelta(days=self.lag_days) + pd.Timedelta(hours=23)
+        return TimeAvailabilityIndex(np.datetime64('1940-01-01T00', 'ns'), last.to_datetime64())
+
+    def _retrieve(self, dataset, variables, times, resolution, levels=None):
+        import cdsapi
+
+        request = {
+            'product_type': ['reanalysis'],
+            'variable': [self.REQUEST_NAMES.get(var, var) for var in variables],
+            'date': f"{times[0]:%Y-%m-%d}/{times[-1]:%Y-%m-%d}",
+            'time': sorted({f"{t:%H:%M}" for t in times}),
+            'grid': [resolution, resolution],
+            'data_format': 'netcdf',
+            'download_format': 'unarchived',
+        }
+        if levels is not None:
+            request['pressure_level'] = [str(level) for level in levels]
+
+        os.makedirs(self.download_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.download_dir, suffix=".nc", delete=False) as f:
+            target = f.name
+        try:
+            cdsapi.Client().retrieve(dataset, request, target)
+            bytes_read = os.path.getsize(target)
+            ds = xr.load_dataset(target)
+        finally:
+            os.remove(target)
+        return ds, bytes_read
+
+    def _to_arco_layout(self, ds, variables):
+        # Newer CDS files use valid_time/pressure_level, older ones time/level
+        ds = ds.rename({name: new for name, new in (('valid_time', 'time'), ('pressure_level', 'level'))
+                        if name in ds.dims or name in ds.coords})
+        ds = ds.rename({self.SHORT_NAMES[var]: var for var in variables})
+        return ds.drop_vars([name for name in ('number', 'expver') if name in ds.coords])
+
+    def read_frames(self, times, variables, levels, resolution, concurrency=1):
+        surface = [var for var in variables if var not in self.PRESSURE_LEVEL_VARIABLES]
+        upper = [var for var in variables if var in self.PRESSURE_LEVEL_VARIABLES]
+
+        parts, bytes_read = [], 0
+        if surface:
+            ds, nbytes = self._retrieve('reanalysis-era5-single-levels', surface, times, resolution)
+            parts.append(self._to_arco_layout(ds, surface))
+            bytes_read += nbytes
+        if upper:
+            ds, nbytes = self._retrieve('reanalysis-era5-pressure-levels', upper, times, resolution, levels)
+            parts.append(self._to_arco_layout(ds, upper))
+            bytes_read += nbytes
+
+        ds = xr.merge(parts).sel(time=times)
+        if 'level' in ds.dims:
+            ds = ds.sel(level=levels)
+        return ds[variables].astype(np.float32), {'bytes_read': bytes_read, 'chunks_read': len(parts)}
+
+    def read_static(self, variables) -> xr.Dataset:
+        time = pd.DatetimeIndex([self.availability().first_time])
+        ds, _ = self._retrieve('reanalysis-era5-single-levels', variables, time, NATIVE_RESOLUTION)
+        return self._to_arco_layout(ds, variables).isel(time=0).drop_vars('time')[variables]
+
+
+_data_sources = {}
+_data_sources_lock = threading.Lock()
+
+
+def get_data_source(name: str = None, path: str = None) -> ERA5DataSource:
+    """
+    Returns the process-wide backend `name` ('arco', 'local' or 'cds') at `path`,
+    defaulting to the `ERA5_DATA_SOURCE` and `ERA5_DATA_PATH` configuration.
+    """
+    name = name or DATA_SOURCE
+    path = path if path is not None else DATA_PATH
+    with _data_sources_lock:
+        if (name, path) not in _data_sources:
+            if name == 'arco':
+                source = ARCOZarrSource(path or ARCO_ERA5_STORE)
+            elif name == 'local':
+                if not path:
+                    raise ValueError("The local ERA5 backend needs ERA5_DATA_PATH to be set.")
+                source = LocalArchiveSource(path)
+            elif name == 'cds':
+                source = CDSSource(path or CDS_DOWNLOAD_DIR)
+            else:
+                raise ValueError(f"Unknown ERA5 data source: {name}")
+            _data_sources[(name, path)] = source
+        return _data_sources[(name, path)]
+
+
+def as_data_source(source=None) -> ERA5DataSource:
+    """
+    Normalises the `source` argument of the loading functions: None selects the
+    configured backend, a string or key-value store is read as a Zarr store in the
+    ARCO layout, and a backend instance is returned as is.
+    """
+    if source is None:
+        return get_data_source()
+    if isinstance(source, ERA5DataSource):
+        return source
+    if isinstance(source, str) and source == ARCO_ERA5_STORE:
+        return get_data_source('arco', source)
+    if isinstance(source, str) and os.path.isdir(source):
+        return get_data_source('local', source)
+    return ZarrDataSource(source)
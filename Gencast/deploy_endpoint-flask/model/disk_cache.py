@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Optional
+
+import xarray as xr
+
+
+class DiskLRUCache:
+    """
+    Content-addressed on-disk cache of xarray datasets with size-based LRU eviction.
+
+    Every entry is stored as a single NetCDF file named after the SHA-256 of its key.
+    The file modification time is refreshed on every hit, so eviction can drop the
+    least recently used entries first once the cache grows above `max_bytes`.
+
+    Parameters:
+    - cache_dir (str): Directory holding the cached files (created if missing).
+    - max_bytes (int): Maximum total size of the cache on disk, in bytes.
+    """
+
+    suffix = ".nc"
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(**parts) -> str:
+        """
+        Builds a stable cache key from keyword arguments. Values are serialised to
+        canonical JSON (sorted keys, non-JSON values through `str`) and hashed.
+        """
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self.path_for(key))
+
+    def get(self, key: str) -> Optional[xr.Dataset]:
+        """
+        Returns the cached dataset for `key` fully loaded in memory, or None on a miss.
+        """
+        path = self.path_for(key)
+        try:
+            ds = xr.load_dataset(path)
+        except FileNotFoundError:
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return ds
+
+    def put(self, key: str, ds: xr.Dataset) -> str:
+        """
+        Stores `ds` under `key` and evicts old entries if the cache is over budget.
+        The file is written to a temporary name first and atomically renamed, so a
+        concurrent reader never sees a partially written entry.
+        """
+        path = self.path_for(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            ds.to_netcdf(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+        return path
+
+    def size_bytes(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self) -> int:
+        """
+        Removes least recently used entries until the cache fits in `max_bytes`.
+
+        Returns:
+        - int: Number of entries removed.
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            total = sum(size for _, _, size in entries)
+            removed = 0
+            for path, _, size in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            return removed
+
+    def _entries(self):
+        """Yields (path, mtime, size) for every complete entry in the cache."""
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, stat.st_mtime, stat.st_size
@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+class StreamingEnsembleReducer:
+    """
+    Reduces ensemble prediction chunks as they are produced by the rollout, instead of
+    combining every member before averaging.
+
+    For every lead time the reducer keeps the member count, the running mean and the
+    running sum of squared deviations (merged batch by batch with Chan's parallel
+    update), so the memory held is two fields per lead time whatever the ensemble size.
+    Members are only written to disk when quantiles or the raw members are requested;
+    quantiles are then computed one lead time at a time from the spilled chunks.
+    Lead times outside `lead_time_window` are dropped as soon as they arrive: the rollout
+    only needs them as autoregressive state, which it keeps on its own.
+
+    Parameters:
+    - quantiles (sequence of float): Quantiles to compute, none by default.
+    - keep_members (bool): Keep the raw members on disk, for `write_members`.
+    - spill_dir (str, optional): Parent directory of the spilled chunks (system temp dir by default).
+    - lead_time_window (tuple, optional): First and last lead time (inclusive, as
+      timedeltas) to keep, all of them by default.
+
+    Usage:
+        with StreamingEnsembleReducer() as reducer:
+            for chunk in rollout_chunks:
+                reducer.update(chunk)
+            ensemble_mean = reducer.mean()
+    """
+
+    def __init__(self, quantiles=(), keep_members: bool = False, spill_dir: str = None,
+                 lead_time_window=None):
+        self.quantiles = tuple(quantiles)
+        self.lead_time_window = lead_time_window
+        self.dropped_steps = 0
+        self.keep_members = keep_members
+        self._spill_parent = spill_dir
+        self._spill_dir = None
+        self._spilled = []
+        # lead time -> [member count, mean, sum of squared deviations], each with a time dim of 1
+        self._stats = {}
+
+    @property
+    def spills(self) -> bool:
+        return bool(self.quantiles) or self.keep_members
+
+    @property
+    def lead_times(self) -> list:
+        return sorted(self._stats)
+
+    @property
+    def num_members(self) -> int:
+        return max((count for count, _, _ in self._stats.values()), default=0)
+
+    def update(self, chunk: xr.Dataset):
+        """
+        Adds a chunk of predictions, with `sample` and `time` dimensions, to the statistics.
+        """
+        if self.lead_time_window is not None:
+            first, last = (pd.Timedelta(bound) for bound in self.lead_time_window)
+            lead_times = chunk.indexes['time']
+            in_window = np.flatnonzero((lead_times >= first) & (lead_times <= last))
+            self.dropped_steps += len(lead_times) - len(in_window)
+            if len(in_window) == 0:
+                return
+            chunk = chunk.isel(time=in_window)
+
+        if self.spills:
+            self._spill(chunk)
+
+        for i, lead_time in enumerate(chunk.indexes['time']):
+            step = chunk.isel(time=[i])
+            count = step.sizes['sample']
+
+            if lead_time not in self._stats:
+                template = step.isel(sample=0, drop=True)
+                zeros = template.copy(data={
+                    var: np.zeros(template[var].shape, dtype=np.result_type(template[var].dtype, np.float32))
+                    for var in template.data_vars
+                })
+                self._stats[lead_time] = [0, zeros, zeros.copy(deep=True)]
+            prev_count, mean, m2 = self._stats[lead_time]
+            total = prev_count + count
+
+            # Chan et al. update of the running mean and squared deviations, in place
+            for var in mean.data_vars:
+                members = np.asarray(step[var].transpose('sample', *mean[var].dims).data)
+                batch_mean = members.mean(axis=0)
+                delta = batch_mean - mean[var].data
+                running_mean, running_m2 = mean[var].data, m2[var].data
+                running_mean += delta * (count / total)
+                running_m2 += delta ** 2 * (prev_count * count / total)
+                if count > 1:
+                    running_m2 += ((members - batch_mean) ** 2).sum(axis=0)
+            self._stats[lead_time][0] = total
+
+    def _combine(self, fields) -> xr.Dataset:
+        return xr.concat(fields, dim='time')
+
+    def mean(self) -> xr.Dataset:
+        """Ensemble mean, for every lead time seen so far."""
+        return self._combine([self._stats[t][1] for t in self.lead_times])
+
+    def variance(self, ddof: int = 1) -> xr.Dataset:
+        """Ensemble variance (unbiased by default), for every lead time seen so far."""
+        return self._combine([m2 / max(count - ddof, 1) for count, _, m2 in
+                              (self._stats[t] for t in self.lead_times)])
+
+    def std(self, ddof: int = 1) -> xr.Dataset:
+        return np.sqrt(self.variance(ddof))
+
+    def _spill(self, chunk: xr.Dataset):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="gencast_members_", dir=self._spill_parent)
+        path = os.path.join(self._spill_dir, f"chunk_{len(self._spilled):05d}.nc")
+        chunk.to_netcdf(path)
+        self._spilled.append((path, set(chunk.indexes['time'])))
+
+    def quantile(self, q=None) -> xr.Dataset:
+        """
+        Ensemble quantiles (the configured ones by default), read back from the spilled
+        members one lead time at a time, with a `quantile` dimension.
+        """
+        if not self.spills:
+            raise ValueError("Quantiles need the members on disk, pass quantiles= or keep_members=True")
+        q = self.quantiles if q is None else q
+        fields = []
+        for lead_time in self.lead_times:
+            members = []
+            for path, times in self._spilled:
+                if lead_time in times:
+                    with xr.open_dataset(path) as ds:
+                        members.append(ds.sel(time=[lead_time]).load())
+            fields.append(xr.concat(members, dim='sample').quantile(q, dim='sample'))
+        return self._combine(fields)
+
+    def write_members(self, path: str) -> str:
+        """Writes the raw members of every lead time to a single NetCDF file."""
+        if not self.keep_members:
+            raise ValueError("The members were not kept, pass keep_members=True")
+        with xr.open_mfdataset([p for p, _ in self._spilled], combine='by_coords') as members:
+            members.to_netcdf(path)
+        return path
+
+    def close(self):
+        """Removes the spilled members."""
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+            self._spilled = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BatchEnsembleReducer:
+    """
+    Reduces the prediction chunks of a rollout of requests stacked along `batch` (see
+    `batching.stack_inputs`), with a `StreamingEnsembleReducer` per request: every
+    request keeps only the lead times of its own window, not those of the longest one.
+
+    Parameters:
+    - lead_time_windows (list of tuple): Lead time window of every request, in batch order.
+
+    Usage:
+        with BatchEnsembleReducer(windows) as reducer:
+            for chunk in rollout_chunks:
+                reducer.update(chunk)
+            means = [r.mean() for r in reducer.reducers]
+    """
+
+    def __init__(self, lead_time_windows):
+        self.reducers = [StreamingEnsembleReducer(lead_time_window=window) for window in lead_time_windows]
+
+    def update(self, chunk: xr.Dataset):
+        """Adds a chunk of predictions of every request, with a `batch` dimension."""
+        for i, reducer in enumerate(self.reducers):
+            reducer.update(chunk.isel(batch=[i]))
+
+    def close(self):
+        for reducer in self.reducers:
+            reducer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
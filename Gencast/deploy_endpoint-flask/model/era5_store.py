@@ -0,0 +1,380 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+
+import fsspec
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Location of the ARCO ERA5 dataset on GCP (Zarr format)
+ARCO_ERA5_STORE = 'gs://gcp-public-data-arco-era5/ar/full_37-1h-0p25deg-chunk-1.zarr-v3'
+
+# Native grid spacing of the ARCO store, in degrees
+NATIVE_RESOLUTION = 0.25
+
+
+class ReadCounter:
+    """
+    Number of chunks and bytes read from `ByteCountingStore`s by one read, see
+    `count_reads`.
+    """
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.chunks_read = 0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes: int):
+        with self._lock:
+            self.bytes_read += nbytes
+            self.chunks_read += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'bytes_read': self.bytes_read, 'chunks_read': self.chunks_read}
+
+
+# Counter of the read in progress on each thread, so concurrent reads of the shared
+# store handle are counted apart
+_read_counters = threading.local()
+
+
+def current_read_counter():
+    """Returns the counter of the read in progress on this thread, or None."""
+    return getattr(_read_counters, 'counter', None)
+
+
+def _set_read_counter(counter):
+    _read_counters.counter = counter
+
+
+@contextlib.contextmanager
+def count_reads():
+    """
+    Counts the chunks and bytes read from `ByteCountingStore`s by this thread (and by
+    the fetch threads of `load_concurrently`) within the block.
+
+    Usage:
+        with count_reads() as counter:
+            ds.compute()
+        counter.stats()
+    """
+    previous = current_read_counter()
+    counter = ReadCounter()
+    _set_read_counter(counter)
+    try:
+        yield counter
+    finally:
+        _set_read_counter(previous)
+
+
+class ByteCountingStore(MutableMapping):
+    """
+    Zarr store wrapper counting the number of chunks and bytes read from the
+    underlying key-value store, so the cost of a selection can be measured. Reads
+    are added to the counter of the calling thread (see `count_reads`), reads
+    outside of a `count_reads` block are not counted.
+
+    Parameters:
+    - store (MutableMapping): The wrapped Zarr store (e.g. an fsspec mapper).
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def _count(self, value):
+        counter = current_read_counter()
+        if counter is not None:
+            counter.add(len(value))
+
+    def __getitem__(self, key):
+        value = self.store[key]
+        self._count(value)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store[key] = value
+
+    def __delitem__(self, key):
+        del self.store[key]
+
+    def __contains__(self, key):
+        return key in self.store
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+
+def open_era5_store(store):
+    """
+    Lazily opens an ERA5 Zarr store (GCS URL or local path) through a byte-counting
+    wrapper. Nothing but the metadata and the index coordinates is read here; data
+    chunks are only fetched when a selection of the dataset is materialised.
+
+    Parameters:
+    - store (str or MutableMapping): URL or path of the Zarr store, or an already
+      constructed key-value store.
+
+    Returns:
+    - ds (xr.Dataset): The lazily opened dataset.
+    - counting_store (ByteCountingStore): The wrapper recording the bytes read.
+    """
+    if isinstance(store, str):
+        storage_options = dict(token='anon') if store.startswith('gs://') else {}
+        store = fsspec.get_mapper(store, **storage_options)
+    counting_store = ByteCountingStore(store)
+    ds = xr.open_zarr(counting_store, chunks=None)
+    return ds, counting_store
+
+
+class TimeAvailabilityIndex:
+    """
+    Availability of the hourly ERA5 frames, stored as an arithmetic range plus the set
+    of known gaps inside it, so that a lookup costs a couple of integer comparisons
+    instead of a scan of the ~750k timestamps of the archive.
+
+    Parameters:
+    - first_time (np.datetime64): First available frame.
+    - last_time (np.datetime64): Last available frame.
+    - freq (np.timedelta64): Spacing of the frames (hourly for ERA5).
+    - gaps (iterable): Frames missing between `first_time` and `last_time`.
+    """
+
+    def __init__(self, first_time, last_time, freq=np.timedelta64(1, 'h'), gaps=()):
+        self.first_time = np.datetime64(first_time, 'ns')
+        self.last_time = np.datetime64(last_time, 'ns')
+        self.freq = np.timedelta64(freq, 'ns')
+        self.gaps = np.sort(np.asarray(list(gaps), dtype='datetime64[ns]'))
+        self._gap_set = set(self.gaps.astype(np.int64).tolist())
+
+    @classmethod
+    def from_time_coordinate(cls, times, valid_time_start: str, valid_time_stop: str,
+                             freq=np.timedelta64(1, 'h')):
+        """
+        Builds the index from the sorted time coordinate of the store and its validity
+        attrs (day strings, the stop day being inclusive). Gaps are searched once here.
+        """
+        times = np.asarray(times, dtype='datetime64[ns]')
+        first = np.datetime64(pd.Timestamp(valid_time_start), 'ns')
+        last = np.datetime64(pd.Timestamp(valid_time_stop) + pd.Timedelta(days=1), 'ns') - np.timedelta64(freq, 'ns')
+
+        # Present frames within the validity window (binary search on the sorted axis)
+        lo = np.searchsorted(times, first, side='left')
+        hi = np.searchsorted(times, last, side='right')
+        present = times[lo:hi]
+        if present.size == 0:
+            return cls(first, first - np.timedelta64(freq, 'ns'), freq)
+        first, last = present[0], present[-1]
+
+        expected_count = int((last - first) // np.timedelta64(freq, 'ns')) + 1
+        gaps = ()
+        if present.size != expected_count:
+            expected = np.arange(first, last + np.timedelta64(freq, 'ns'), np.timedelta64(freq, 'ns'))
+            gaps = np.setdiff1d(expected, present)
+        return cls(first, last, freq, gaps)
+
+    def __contains__(self, time) -> bool:
+        time = np.datetime64(time, 'ns')
+        if time < self.first_time or time > self.last_time:
+            return False
+        if (time - self.first_time) % self.freq:
+            return False
+        return int(time.astype(np.int64)) not in self._gap_set
+
+    def contains_many(self, times) -> np.ndarray:
+        """
+        Vectorised availability check.
+
+        Parameters:
+        - times (array-like): Timestamps to check.
+
+        Returns:
+        - np.ndarray: Boolean mask, True where the frame is available.
+        """
+        times = np.asarray(times, dtype='datetime64[ns]')
+        mask = (times >= self.first_time) & (times <= self.last_time)
+        mask &= ((times - self.first_time) % self.freq) == np.timedelta64(0, 'ns')
+        if self.gaps.size:
+            mask &= ~np.isin(times, self.gaps)
+        return mask
+
+    def available_inits(self, init_times, n_frames: int = 2, step=np.timedelta64(12, 'h')) -> np.ndarray:
+        """
+        Bulk check of many init times at once (e.g. for hindcast batches): an init time
+        is usable when all its `n_frames` input frames, `step` apart, are available.
+
+        Returns:
+        - np.ndarray: Boolean mask over `init_times`.
+        """
+        init_times = np.asarray(init_times, dtype='datetime64[ns]')
+        offsets = np.arange(n_frames) * np.timedelta64(step, 'ns')
+        frames = init_times[:, None] + offsets[None, :]
+        return self.contains_many(frames.ravel()).reshape(frames.shape).all(axis=1)
+
+
+# Interval between two refreshes of the store metadata (valid_time_stop_era5t)
+METADATA_REFRESH_SECONDS = float(os.environ.get("ERA5_METADATA_REFRESH_SECONDS", 3600))
+
+
+class ERA5StoreManager:
+    """
+    Process-level handle on an ERA5 Zarr store.
+
+    The dataset is opened once and kept with its decoded index coordinates and attrs,
+    so requests do not re-parse the consolidated metadata and the (very long) time
+    coordinate. The attrs, which carry `valid_time_stop_era5t`, are re-read from the
+    metadata on a timer; the dataset itself is only re-opened if the shape of the
+    time axis changed in the meantime.
+
+    Parameters:
+    - store (str or MutableMapping): URL or path of the Zarr store, or a key-value store.
+    - refresh_interval (float): Seconds between two metadata refreshes.
+    - clock (callable): Monotonic clock in seconds, injectable for tests.
+    """
+
+    def __init__(self, store, refresh_interval: float = METADATA_REFRESH_SECONDS, clock=time.monotonic):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self._lock = threading.RLock()
+        self._ds = None
+        self._counting_store = None
+        self._attrs = None
+        self._time_shape = None
+        self._availability = None
+        self._last_refresh = None
+
+    def _open(self):
+        self._ds, self._counting_store = open_era5_store(self.store)
+        self._attrs = dict(self._ds.attrs)
+        self._time_shape = self._read_metadata().get('time/.zarray', {}).get('shape')
+        self._build_availability()
+        self._last_refresh = self.clock()
+
+    def _build_availability(self):
+        self._availability = TimeAvailabilityIndex.from_time_coordinate(
+            self._ds.indexes['time'].values, self._attrs['valid_time_start'], self.latest_time_str)
+
+    def _read_metadata(self) -> dict:
+        """Reads the consolidated metadata, falling back to the root attrs only."""
+        try:
+            return json.loads(self._counting_store.store['.zmetadata'])['metadata']
+        except KeyError:
+            return {'.zattrs': json.loads(self._counting_store.store['.zattrs'])}
+
+    def open(self):
+        """
+        Returns the shared lazily opened dataset and its byte-counting store, opening
+        the store on first use and refreshing its attrs if they are due.
+        """
+        with self._lock:
+            if self._ds is None:
+                self._open()
+            elif self.clock() - self._last_refresh >= self.refresh_interval:
+                self.refresh()
+            return self._ds, self._counting_store
+
+    @property
+    def dataset(self) -> xr.Dataset:
+        return self.open()[0]
+
+    @property
+    def attrs(self) -> dict:
+        self.open()
+        return self._attrs
+
+    @property
+    def latest_time_str(self) -> str:
+        attrs = self._attrs if self._attrs is not None else self.attrs
+        return attrs.get('valid_time_stop_era5t', attrs.get('valid_time_stop'))
+
+    @property
+    def availability(self) -> TimeAvailabilityIndex:
+        """Availability index of the frames, rebuilt whenever the attrs change."""
+        self.open()
+        return self._availability
+
+    def refresh(self) -> bool:
+        """
+        Re-reads the store attrs from the metadata (a single small GET).
+
+        Returns:
+        - bool: True if `valid_time_stop_era5t` changed.
+        """
+        with self._lock:
+            if self._ds is None:
+                self._open()
+                return True
+            previous_stop = self._attrs.get('valid_time_stop_era5t', self._attrs.get('valid_time_stop'))
+            metadata = self._read_metadata()
+            time_shape = metadata.get('time/.zarray', {}).get('shape')
+            if time_shape != self._time_shape:
+                # The time axis was extended, re-open to pick up the new coordinate
+                self._open()
+            else:
+                self._attrs = dict(metadata.get('.zattrs', self._attrs))
+                self._ds.attrs = dict(self._attrs)
+                if self.latest_time_str != previous_stop:
+                    self._build_availability()
+                self._last_refresh = self.clock()
+            return self.latest_time_str != previous_stop
+
+
+_store_managers = {}
+_store_managers_lock = threading.Lock()
+
+
+def get_store_manager(store) -> ERA5StoreManager:
+    """
+    Returns the process-wide manager of `store`. Managers of store URLs and paths are
+    shared across requests; a key-value store object gets a manager of its own.
+    """
+    if not isinstance(store, str):
+        return ERA5StoreManager(store)
+    with _store_managers_lock:
+        if store not in _store_managers:
+            _store_managers[store] = ERA5StoreManager(store)
+        return _store_managers[store]
+
+
+def load_concurrently(ds: xr.Dataset, concurrency: int) -> xr.Dataset:
+    """
+    Materialises a lazy selection of a Zarr-backed dataset, fetching the chunks of all
+    variables in a bounded thread pool instead of one after another.
+
+    Each variable is split into one task per native Zarr chunk along the dimensions
+    the store chunks one element at a time (`time` for ARCO, plus `level` on stores
+    chunked per level), so no chunk is fetched twice. The fetch threads add their reads
+    to the counter of the calling thread (see `count_reads`).
+
+    Parameters:
+    - ds (xr.Dataset): Lazily opened (``chunks=None``) and already selected dataset.
+    - concurrency (int): Maximum number of chunks fetched at the same time. A value
+      of 1 falls back to a plain sequential ``compute()``.
+
+    Returns:
+    - xr.Dataset: The dataset loaded into memory.
+    """
+    if concurrency <= 1:
+        return ds.compute()
+
+    tasks = {}
+    for name, var in ds.data_vars.items():
+        preferred_chunks = var.encoding.get('preferred_chunks', {})
+        tasks[name] = var.chunk({
+            dim: 1 if preferred_chunks.get(dim) == 1 else -1 for dim in var.dims
+        })
+
+    # A pool of this read's own, so its threads count into the caller's counter only
+    with ThreadPoolExecutor(concurrency, initializer=_set_read_counter,
+                            initargs=(current_read_counter(),)) as pool:
+        loaded = ds.assign(tasks).compute(scheduler='threads', pool=pool)
+    return loaded
@@ -0,0 +1,110 @@
+import os
+import threading
+from typing import Optional
+
+import xarray as xr
+
+from data_sources import as_data_source
+from disk_cache import DiskLRUCache
+
+# Set to 0 to run every forecast, even when the same one was produced before
+FORECAST_CACHE_ENABLED = os.environ.get("GENCAST_FORECAST_CACHE", "1") == "1"
+
+# Local cache of finished forecasts, shared by all requests of the process
+FORECAST_CACHE_DIR = os.environ.get("GENCAST_FORECAST_CACHE_DIR", "/opt/ml/cache/forecasts")
+FORECAST_CACHE_MAX_BYTES = int(os.environ.get("GENCAST_FORECAST_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+
+
+def forecast_key(effective_current_date_obj, num_steps: int, num_ensemble_members: int, seed: int,
+                 checkpoint_digest: str, num_steps_per_chunk: int = 1, resolution: float = 1.0,
+                 precision: str = "float32", source=None) -> str:
+    """
+    Builds the cache key of a finished forecast. Requests whose dates resolve to the same
+    effective init date and rollout length (see `compute_effective_dates`) share a key,
+    as long as they run the same ensemble (size, seed, chunking) of the same model on
+    the same data source.
+    """
+    return DiskLRUCache.make_key(
+        init_time=effective_current_date_obj.isoformat(),
+        steps=int(num_steps),
+        ensemble=int(num_ensemble_members),
+        seed=int(seed),
+        steps_per_chunk=int(num_steps_per_chunk),
+        checkpoint=checkpoint_digest,
+        resolution=float(resolution),
+        precision=precision,
+        source=as_data_source(source).cache_id,
+    )
+
+
+class ForecastCache(DiskLRUCache):
+    """
+    On-disk LRU cache of finished forecasts (see `DiskLRUCache`), counting its hits and
+    misses. Every forecast is stored with the location it was uploaded to, so a hit can
+    be answered with that location without reading or uploading the forecast again.
+    """
+
+    # Attribute of the cached forecasts holding their upload location
+    location_attr = "output_location"
+
+    def __init__(self, cache_dir: str = FORECAST_CACHE_DIR, max_bytes: int = FORECAST_CACHE_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+        self._counter_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hit: bool):
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[xr.Dataset]:
+        ds = super().get(key)
+        self._count(ds is not None)
+        return ds
+
+    def put(self, key: str, ds: xr.Dataset, location: str = None) -> str:
+        """Stores a forecast, with the location it was uploaded to if given."""
+        if location is not None:
+            ds = ds.assign_attrs({self.location_attr: location})
+        return super().put(key, ds)
+
+    def get_location(self, key: str) -> Optional[str]:
+        """
+        Returns the upload location of the forecast of `key`, or None on a miss (or when
+        it was stored without one). Only the file metadata is read.
+        """
+        path = self.path_for(key)
+        try:
+            with xr.open_dataset(path) as ds:
+                location = ds.attrs.get(self.location_attr)
+            # Mark the entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            location = None
+        self._count(location is not None)
+        return location
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bytes": self.size_bytes(),
+        }
+
+
+_forecast_cache = None
+
+
+def get_forecast_cache():
+    """
+    Returns the process-wide forecast cache, creating it on first use.
+    """
+    global _forecast_cache
+    if _forecast_cache is None:
+        _forecast_cache = ForecastCache()
+    return _forecast_cache
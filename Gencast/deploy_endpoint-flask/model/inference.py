@@ -1,100 +1,361 @@
-from flask import Flask, request, jsonify, Response, make_response
-from resources import gencast_predict
-from loading_API_data import get_input_data
+from flask import Flask, request, jsonify
+from loading_API_data import assemble_input_data, compute_effective_dates
+from memory_report import MemoryReport
+from static_fields import get_static_fields_store
+from prefetcher import ERA5Prefetcher, PREFETCH_ENABLED
+from planner import plan_from_request
+from batching import MAX_BATCH_SIZE, RequestBatcher
+from cpu_devices import configure_from_env
+from forecast_cache import FORECAST_CACHE_ENABLED, forecast_key, get_forecast_cache
+from single_flight import SingleFlight
+from jobs import JOB_WORKERS, JobQueue, QueueFull
+from pipeline import FETCH_WORKERS, OUTPUT_WORKERS, Stage, StagedExecutor
 
 import json
 import xarray as xr
 import numpy as np
 import os
+import threading
 import uuid
-import boto3
-from graphcast import checkpoint
-from graphcast import gencast
+
+# JAX, haiku, graphcast (`resources`, `compilation_cache`) and boto3 are imported on first
+# use, so the server starts and answers /ping without paying for them
 
 app = Flask(__name__)
 
 # Dummy model object
 model = {"name": "dummy_model"}
 
+# Checkpoint served by the endpoint: the .npz, or a directory converted by `mmap_checkpoint.py`
+MODEL_PATH = os.environ.get("GENCAST_CHECKPOINT", "/opt/ml/model/GenCast_1p0deg_2019.npz")
+
+# Set to 0 to skip the warm-up compilation at boot (the first request then compiles)
+WARM_UP_ENABLED = os.environ.get("GENCAST_WARM_UP", "1") == "1"
+
+# Memory report of every input assembly. tracemalloc traces the whole process, so the
+# report is only taken with a single job worker, when no other job's rollout can run
+# during the assembly and count in its peaks
+MEMORY_REPORT_ENABLED = bool(os.environ.get("GENCAST_MEMORY_REPORT")) and JOB_WORKERS == 1
+
 # 1. Load the model
 def model_fn(model_path):
     print(">>> model_fn called")
-    with open(model_path, "rb") as f:
-        ckpt = checkpoint.load(f, gencast.CheckPoint)
+    from graphcast import gencast
+    from mmap_checkpoint import load_any_checkpoint
+
+    # A converted checkpoint directory is memory-mapped, its params are read on first use
+    ckpt = load_any_checkpoint(model_path, gencast.CheckPoint)
     return ckpt
 
+_predictors = {}
+_predictors_lock = threading.Lock()
+
+
+def get_predictor(model_path):
+    """
+    Returns the process-wide predictor of a checkpoint, loading the checkpoint and
+    building the predictor on first use only, so its compiled executables are reused
+    by every later request.
+    """
+    from compilation_cache import (COMPILATION_CACHE_ENABLED, checkpoint_hash, enable_compilation_cache,
+                                   executable_key)
+    from resources import GenCastPredictor
+
+    with _predictors_lock:
+        if model_path not in _predictors:
+            predictor = GenCastPredictor(model_fn(model_path))
+            if COMPILATION_CACHE_ENABLED:
+                # Load the executables compiled by a previous replica (or `compilation_cache.py`)
+                enable_compilation_cache(executable_key(
+                    checkpoint_hash(model_path), predictor.resolution, predictor.num_ensemble_members,
+                    predictor.precision))
+            _predictors[model_path] = predictor
+        return _predictors[model_path]
+
+_ready = threading.Event()
+_boot_error = None
+
+
+def boot(model_path=MODEL_PATH, warm_up=WARM_UP_ENABLED):
+    """
+    Loads the checkpoint, the normalization statistics and the predictor once for the
+    process, then compiles the forward function by a warm-up rollout. /ping reports
+    healthy, and /invocations accepts requests, only once this has finished.
+    """
+    global _boot_error
+    try:
+        predictor = get_predictor(model_path)
+        if warm_up:
+            predictor.warm_up()
+        _ready.set()
+        print(">>> Model ready")
+    except Exception as e:
+        _boot_error = e
+        print(f">>> Model failed to load: {e}")
+
+_batchers = {}
+
+
+def get_batcher(model):
+    """Returns the request batcher of a predictor, started on first use."""
+    with _predictors_lock:
+        if id(model) not in _batchers:
+            _batchers[id(model)] = RequestBatcher(model).start()
+        return _batchers[id(model)]
+
 # 2. Dummy input processor
-def input_fn(input_data, content_type):
+def input_fn(input_data, content_type, effective_dates=None):
+    """
+    Assembles the model inputs of a request. `effective_dates` (effective init date and
+    number of steps, see `parse_request`) are derived from the request dates unless given.
+    """
     print(">>> input_fn called")
     if content_type == "application/json":
-        data = json.loads(input_data)
-        currentDate = data["currentDate"]
-        targetDate = data["targetDate"]
-        model_input_data = get_input_data(currentDate, targetDate)
+        if effective_dates is None:
+            data = json.loads(input_data)
+            effective_dates = compute_effective_dates(data["currentDate"], data["targetDate"])
+        memory_report = MemoryReport("input assembly") if MEMORY_REPORT_ENABLED else None
+        model_input_data = assemble_input_data(*effective_dates, memory_report=memory_report)
         return model_input_data
     else:
         raise ValueError(f"Unsupported content type: {content_type}")
 
 
-# 3. Run prediction
-def predict_fn(input_data, model):
+# 3. Plan the rollout (ensemble size, chunking, seed) from the request options
+def plan_fn(input_data, num_steps):
+    print(">>> plan_fn called")
+    data = json.loads(input_data)
+    plan = plan_from_request(data, num_steps=num_steps)
+    print(f">>> Rollout plan: {plan}")
+    return plan
+
+
+def forecast_key_fn(effective_current_date_obj, num_steps, model, model_path, plan):
+    """
+    Key of the forecast of a request (forecast cache and coalescing): its effective init
+    date and rollout length, derived from the request dates alone (see
+    `compute_effective_dates`), so a cached forecast skips the ERA5 fetch too.
+    """
+    from compilation_cache import checkpoint_hash
+
+    return forecast_key(effective_current_date_obj, num_steps, plan.num_ensemble_members, plan.seed,
+                        checkpoint_hash(model_path), plan.num_steps_per_chunk, model.resolution, model.precision)
+
+
+# Concurrent requests for the same forecast (same `forecast_key_fn`) share one computation
+_forecast_flights = SingleFlight()
+
+
+# 4. Run prediction
+def predict_fn(input_data, model, plan=None):
     print(">>> predict_fn called")
-    prediction = gencast_predict(input_data, model)
+    from resources import gencast_predict
+
+    predict_options = plan.predict_options() if plan is not None else {}
+    if MAX_BATCH_SIZE > 1:
+        # Concurrent requests with the same options share one rollout
+        return get_batcher(model).submit(input_data, predict_options).result()
+    prediction = gencast_predict(input_data, model, **predict_options)
     return prediction
 
-# 4. Format the output
+# 5. Format the output
 def output_fn(prediction, accept):
     print(">>> output_fn called")
+    output_id = uuid.uuid4()
     output_dir = os.environ.get("SM_OUTPUT_DATA_DIR", "/opt/ml/output")
-    output_path = os.path.join(output_dir, "predictions.nc")
+    # One file per forecast, concurrent jobs write their outputs side by side
+    output_path = os.path.join(output_dir, f"predictions-{output_id}.nc")
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     prediction.to_netcdf(output_path)
 
     # Upload to S3
+    import boto3
+
     s3 = boto3.client("s3")
     bucket = "gencast-async"
-    key = f"async-output/predictions-{uuid.uuid4()}.nc"
+    key = f"async-output/predictions-{output_id}.nc"
     s3.upload_file(output_path, bucket, key)
+    os.remove(output_path)
     print(f">>> Uploaded prediction to s3://{bucket}/{key}")
+    return f"s3://{bucket}/{key}"
+
+
+def parse_request(input_data_json):
+    """
+    Validates a forecast request and plans its rollout.
+
+    Returns:
+    - effective_current_date_obj (datetime), num_steps (int), plan (RolloutPlan)
+
+    Raises:
+    - KeyError, ValueError: On a malformed request.
+    """
+    data = json.loads(input_data_json)
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected a JSON object, got {type(data).__name__}")
+    for field in ("currentDate", "targetDate"):
+        if not isinstance(data[field], str):
+            raise ValueError(f"{field} must be a 'YYYY-MM-DD' string, got {data[field]!r}")
+    effective_current_date_obj, num_steps = compute_effective_dates(data["currentDate"], data["targetDate"])
+    plan = plan_fn(input_data_json, num_steps)
+    return effective_current_date_obj, num_steps, plan
+
+
+# Stages of a forecast job, run by the pipeline so that the inputs of the next job are
+# assembled, and the output of the previous one uploaded, while the current rollout runs.
+# Forecasts found in the cache do not go through the pipeline (see `run_forecast`)
+def fetch_stage(job):
+    """
+    Assembles the inputs of the job, for the init date and number of steps its key and
+    plan were computed with (the ERA5T lag may have moved on since).
+    """
+    job["inputs"] = input_fn(job["request"], content_type="application/json",
+                             effective_dates=(job["effective_current_date"], job["num_steps"]))
+    return job
+
+
+def rollout_stage(job):
+    """Runs the rollout of the job."""
+    job["prediction"] = predict_fn(job.pop("inputs"), job["model"], job["plan"])
+    return job
+
+
+def output_stage(job):
+    """Uploads the new forecast and caches it with its location, returns its S3 location."""
+    location = output_fn(job["prediction"], "application/json")
+    if FORECAST_CACHE_ENABLED:
+        get_forecast_cache().put(job["key"], job["prediction"], location=location)
+    return location
+
+
+_pipeline = None
+
+
+def get_pipeline():
+    """Returns the process-wide forecast pipeline, started on first use."""
+    global _pipeline
+    with _predictors_lock:
+        if _pipeline is None:
+            _pipeline = StagedExecutor([
+                Stage("fetch", fetch_stage, FETCH_WORKERS),
+                # With batching, enough concurrent rollouts to fill a batch
+                Stage("rollout", rollout_stage, MAX_BATCH_SIZE),
+                Stage("output", output_stage, OUTPUT_WORKERS),
+            ]).start()
+        return _pipeline
+
+
+def cached_forecast_location(key):
+    """Returns the S3 location of the forecast of `key` if it is in the forecast cache, or None."""
+    if not FORECAST_CACHE_ENABLED:
+        return None
+    cache = get_forecast_cache()
+    location = cache.get_location(key)
+    print(f">>> Forecast cache {'miss' if location is None else 'hit'} {key[:12]} "
+          f"({cache.hits} hits, {cache.misses} misses)")
+    return location
+
+
+def run_forecast(input_data_json):
+    """
+    Runs the forecast of a request end to end (a job of the job queue) and returns the
+    S3 location of its output. A forecast found in the cache is answered with the location
+    it was uploaded to, others go through the pipeline. Concurrent requests for the same
+    forecast share one run, and its output.
+    """
+    model = get_predictor(MODEL_PATH)
+    effective_current_date_obj, num_steps, plan = parse_request(input_data_json)
+    key = forecast_key_fn(effective_current_date_obj, num_steps, model, MODEL_PATH, plan)
+
+    def forecast():
+        # Hits do not queue behind the rollouts of the pipeline
+        location = cached_forecast_location(key)
+        if location is not None:
+            return location
+        job = {"request": input_data_json, "model": model, "plan": plan, "key": key,
+               "effective_current_date": effective_current_date_obj, "num_steps": num_steps}
+        return get_pipeline().submit(job).result()
+
+    return _forecast_flights.do(key, forecast)
+
+
+_job_queue = None
+
+
+def get_job_queue():
+    """Returns the process-wide job queue, its workers started on first use."""
+    global _job_queue
+    with _predictors_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(run_forecast).start()
+        return _job_queue
 
 
     
 @app.route("/ping", methods=["GET"])
 def ping():
+    if _boot_error is not None:
+        return f"Model failed to load: {_boot_error}", 500
+    if not _ready.is_set():
+        return "Loading", 503
     return "Healthy", 200
 
 
 @app.route("/invocations", methods=["POST"])
 def invoke():
+    """
+    Queues a forecast job and returns its id at once (202), the forecast runs on the
+    job workers. Poll `/jobs/<id>` for its status and output location.
+    """
+    if not _ready.is_set():
+        return jsonify({"error": "Model is loading"}), 503
     try:
-        MODEL_PATH = "./GenCast_1p0deg_2019.npz"  # Update this path if needed
-        # Step 1: Load the model
-        model = model_fn(MODEL_PATH)
-        # Step 2: Create a sample input
-        sample_input = {
-            "currentDate": "2019-03-29",
-            "targetDate": "2019-04-01"
-        }
-        input_data_json = json.dumps(sample_input)
-
-        # Step 3: Process the input
-        processed_input = input_fn(input_data_json, content_type="application/json")
-
-        # Step 4: Run prediction
-        prediction = predict_fn(processed_input, model)
-
-        # Step 5: Format the output and store to S3
-        output_fn(prediction, request.headers.get("Accept", "application/json"))
-
-        # Proper async inference response
-        response = make_response("", 204)
-        response.headers["Content-Length"] = "0"
-        return response
+        if request.mimetype != "application/json":
+            raise ValueError(f"Unsupported content type: {request.mimetype}")
+        input_data_json = request.get_data(as_text=True)
+        # Reject malformed requests now rather than in the job
+        parse_request(input_data_json)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    try:
+        job_id = get_job_queue().submit(input_data_json)
+    except QueueFull as e:
+        response = jsonify({"error": f"Too many queued forecasts: {e}"})
+        response.headers["Retry-After"] = "60"
+        return response, 429
+
+    response = jsonify({"jobId": job_id, "status": "queued"})
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response, 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify({
+        "jobId": job["id"],
+        "status": job["status"],
+        "result": job["result"],
+        "error": job["error"],
+        "createdAt": job["created_at"],
+        "startedAt": job["started_at"],
+        "finishedAt": job["finished_at"],
+    }), 200
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080)
+    # On CPU-only instances, expose the cores as JAX devices before JAX is first imported
+    configure_from_env()
+    # Load the static fields once at process start, requests then merge them without network I/O
+    get_static_fields_store().load_all()
+    # Warm the input cache in the background as new ERA5T frames are published
+    if PREFETCH_ENABLED:
+        ERA5Prefetcher().start()
+    # Load and compile the model while the server already answers /ping (unhealthy until ready)
+    threading.Thread(target=boot, name="gencast-boot", daemon=True).start()
+    # Request threads only queue jobs and answer status polls, the rollouts run on the job workers
+    app.run(host="0.0.0.0", port=8080, threaded=True)
 
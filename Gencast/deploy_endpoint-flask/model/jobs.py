@@ -0,0 +1,126 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Optional
+
+# Number of forecast jobs in progress at once. The forecast pipeline bounds the rollouts
+# themselves, more workers let the next jobs be fetched while a rollout runs
+JOB_WORKERS = int(os.environ.get("GENCAST_JOB_WORKERS", 4))
+
+# Largest number of jobs waiting for a worker, further submissions are refused (429)
+JOB_QUEUE_DEPTH = int(os.environ.get("GENCAST_JOB_QUEUE_DEPTH", 8))
+
+# SQLite file of the job records, so statuses survive a restart (in memory by default)
+JOB_DB_PATH = os.environ.get("GENCAST_JOB_DB", ":memory:")
+
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION_SECONDS = float(os.environ.get("GENCAST_JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class QueueFull(Exception):
+    """Raised by `JobQueue.submit` when `max_depth` jobs are already waiting."""
+
+
+class JobQueue:
+    """
+    Runs forecast jobs on a bounded pool of worker threads.
+
+    `submit` stores the job and returns its id at once; a worker later calls
+    `run_fn(payload)`, whose return value (e.g. the S3 location of the forecast) is
+    recorded as the job result. Job records are kept in SQLite; jobs still queued or
+    running when the process stopped are marked failed when the queue is reopened.
+
+    Parameters:
+    - run_fn (callable): Runs a job from its payload, returns its result location.
+    - num_workers (int): Number of jobs run concurrently.
+    - max_depth (int): Largest number of waiting jobs (admission control).
+    - db_path (str): SQLite database of the job records, ":memory:" for none.
+
+    Usage:
+        jobs = JobQueue(run_forecast).start()
+        job_id = jobs.submit(request_body)
+        jobs.get(job_id)["status"]
+    """
+
+    def __init__(self, run_fn, num_workers: int = JOB_WORKERS, max_depth: int = JOB_QUEUE_DEPTH,
+                 db_path: str = JOB_DB_PATH, retention_seconds: float = JOB_RETENTION_SECONDS):
+        self.run_fn = run_fn
+        self.num_workers = num_workers
+        self.retention_seconds = retention_seconds
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._threads = []
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db_lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, payload TEXT, result TEXT, "
+                "error TEXT, created_at REAL, started_at REAL, finished_at REAL)")
+            self._db.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?)",
+                             (FAILED, "interrupted by a restart", time.time(), QUEUED, RUNNING))
+
+    def _update(self, job_id: str, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._db_lock, self._db:
+            self._db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def submit(self, payload: str) -> str:
+        """
+        Queues a job and returns its id.
+
+        Raises:
+        - QueueFull: When `max_depth` jobs are already waiting.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._db_lock, self._db:
+            self._db.execute("DELETE FROM jobs WHERE finished_at < ?", (now - self.retention_seconds,))
+            self._db.execute("INSERT INTO jobs (id, status, payload, created_at) VALUES (?, ?, ?, ?)",
+                             (job_id, QUEUED, payload, now))
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except queue.Full:
+            with self._db_lock, self._db:
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            raise QueueFull(f"{self._queue.maxsize} jobs are already waiting")
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Returns the record of a job (status, result, error, timestamps), or None."""
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT id, status, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker."""
+        return self._queue.qsize()
+
+    def _work(self):
+        while True:
+            job_id, payload = self._queue.get()
+            self._update(job_id, status=RUNNING, started_at=time.time())
+            try:
+                result = self.run_fn(payload)
+            except Exception as e:
+                traceback.print_exc()
+                self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+            else:
+                self._update(job_id, status=SUCCEEDED, result=result, finished_at=time.time())
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        """Starts the worker threads (daemons)."""
+        while len(self._threads) < self.num_workers:
+            thread = threading.Thread(target=self._work, name=f"gencast-job-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
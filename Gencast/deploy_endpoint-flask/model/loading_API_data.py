@@ -1,5 +1,5 @@
+import contextlib
 import os
-import cdsapi
 import xarray as xr
 import numpy as np
 import zipfile
@@ -10,51 +10,96 @@ from datetime import datetime, timedelta
 import xarray as xr
 import numpy as np
 import pandas as pd
-import gcsfs
 
-def extract_arco_era5_data(user_current_date: str, user_target_date: str):
+from disk_cache import DiskLRUCache
+from data_sources import as_data_source
+from static_fields import STATIC_VARIABLES, get_static_fields_store
+
+# Pressure levels relevant for forecasting
+LEVELS = [50, 100, 150, 200, 250, 300, 400, 500, 600, 700, 850, 925, 1000]
+
+# Meteorological variables read from the store for every request. The static
+# variables ('land_sea_mask', 'geopotential_at_surface') come from the static fields store.
+VARIABLES = [
+    '2m_temperature', 'sea_surface_temperature', 'mean_sea_level_pressure',
+    '10m_v_component_of_wind', '10m_u_component_of_wind',
+    'u_component_of_wind', 'specific_humidity', 'temperature',
+    'vertical_velocity', 'v_component_of_wind', 'geopotential'
+]
+
+# Floating point type of the assembled model inputs
+INPUT_DTYPE = np.float32
+
+# Local cache of prepared input slices, shared by all requests of the process
+INPUT_CACHE_DIR = os.environ.get("ERA5_CACHE_DIR", "/opt/ml/cache/era5")
+INPUT_CACHE_MAX_BYTES = int(os.environ.get("ERA5_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+
+# Number of Zarr chunks fetched concurrently when reading a slice
+FETCH_CONCURRENCY = int(os.environ.get("ERA5_FETCH_CONCURRENCY", 16))
+
+_input_cache = None
+
+
+def get_input_cache():
     """
-    Extracts ERA5 weather data from the ARCO public dataset on GCP for a given date range.
-    Applies lag logic to ensure compatibility with ERA5T data availability and prepares
-    the dataset for forecasting.
+    Returns the process-wide ERA5 input slice cache, creating it on first use.
+    """
+    global _input_cache
+    if _input_cache is None:
+        _input_cache = DiskLRUCache(INPUT_CACHE_DIR, INPUT_CACHE_MAX_BYTES)
+    return _input_cache
+
+
+def apply_era5t_lag(user_current_date_obj, today=None):
+    """
+    Maps a requested init date to the init date actually available in ERA5T: a date
+    within the last 6 days is shifted back to 6 days before `today`.
 
     Parameters:
-    - user_current_date (str): The starting date for prediction (format: 'YYYY-MM-DD').
-    - user_target_date (str): The target date to predict towards (format: 'YYYY-MM-DD').
+    - user_current_date_obj (datetime): Requested init date (midnight).
+    - today (datetime, optional): Reference "now", defaults to `datetime.today()`.
 
     Returns:
-    - ds_1deg (xr.Dataset): Downsampled dataset with selected variables and coordinates.
-    - nb_of_steps_to_perform (int): Number of prediction steps required.
+    - datetime: Effective init date.
     """
+    today = datetime.today() if today is None else today
 
-    # Load the ARCO ERA5 dataset from GCP (Zarr format)
-    ds = xr.open_zarr(
-        'gs://gcp-public-data-arco-era5/ar/full_37-1h-0p25deg-chunk-1.zarr-v3',
-        chunks=None,
-        storage_options=dict(token='anon')
-    )
+    # Apply lag logic: if the current date is within the last 6 days, shift it back
+    days_ago = (today - user_current_date_obj).days
+    if 0 <= days_ago <= 6:
+        lag = 6 - days_ago
+        return user_current_date_obj - timedelta(days=lag)
+    return user_current_date_obj
+
+
+def compute_effective_dates(user_current_date: str, user_target_date: str, today=None):
+    """
+    Applies the ERA5T lag logic to the user dates and derives the rollout length.
 
-    # Get the latest available time from dataset metadata
-    latest_time_str = ds.attrs.get('valid_time_stop_era5t', ds.attrs.get('valid_time_stop'))
-    latest_time = datetime.strptime(latest_time_str, "%Y-%m-%d")
-    today = datetime.today()
+    Parameters:
+    - user_current_date (str): The starting date for prediction (format: 'YYYY-MM-DD').
+    - user_target_date (str): The target date to predict towards (format: 'YYYY-MM-DD').
+    - today (datetime, optional): Reference "now", defaults to `datetime.today()`.
 
+    Returns:
+    - effective_current_date_obj (datetime): Init date actually used for the forecast.
+    - nb_of_steps_to_perform (int): Number of prediction steps required.
+    """
     # Convert user input dates to datetime objects
     user_current_date_obj = datetime.strptime(user_current_date, '%Y-%m-%d')
     user_target_date_obj = datetime.strptime(user_target_date, '%Y-%m-%d')
 
-    # Apply lag logic: if the current date is within the last 6 days, shift it back
-    days_ago = (today - user_current_date_obj).days
-    if 0 <= days_ago <= 6:
-        lag = 6 - days_ago
-        effective_current_date_obj = user_current_date_obj - timedelta(days=lag)
-    else:
-        effective_current_date_obj = user_current_date_obj
+    effective_current_date_obj = apply_era5t_lag(user_current_date_obj, today=today)
 
     # Calculate the number of days to predict
     days_prediction_length = (user_target_date_obj - effective_current_date_obj).days
     print(f"The number of days to predict to get to target date is {days_prediction_length} (+2 for 72hrs pred)")
 
+    # The target date cannot precede the init date actually used (after the ERA5T lag)
+    if days_prediction_length < 0:
+        raise ValueError(f"Target date {user_target_date} is before the effective current date "
+                         f"{effective_current_date_obj:%Y-%m-%d}.")
+
     # Limit prediction range to 13 days to allow for 72-hour forecasts
     if days_prediction_length > 13:
         raise ValueError("Target date exceeds the 13-day prediction limit.")
@@ -62,34 +107,62 @@ def extract_arco_era5_data(user_current_date: str, user_target_date: str):
     # Calculate the number of prediction steps (every 12 hours + extra for 72h forecast)
     nb_of_steps_to_perform = (days_prediction_length * 2) + 1 + 4
 
+    return effective_current_date_obj, nb_of_steps_to_perform
+
+
+def input_cache_key(effective_current_date_obj, variables, levels, resolution, source=None):
+    """
+    Builds the content-addressed cache key of a prepared input slice.
+    """
+    return DiskLRUCache.make_key(
+        init_time=effective_current_date_obj.isoformat(),
+        variables=list(variables),
+        levels=[int(level) for level in levels],
+        resolution=float(resolution),
+        source=as_data_source(source).cache_id,
+    )
+
+
+def load_era5_slice(effective_current_date_obj, variables=VARIABLES, levels=LEVELS,
+                    resolution=1.0, source=None, read_stats=None, concurrency=None):
+    """
+    Reads the two 12-hourly input frames starting at the effective init date from the
+    ERA5 backend and prepares them for forecasting.
+
+    The backend applies the time, variable, level and grid stride selections before
+    anything is materialised, so only the requested frames at the requested resolution
+    are ever held in memory.
+
+    Parameters:
+    - effective_current_date_obj (datetime): Init date of the forecast (after lag logic).
+    - variables (list): Variables to read.
+    - levels (list): Pressure levels to read.
+    - resolution (float): Output grid spacing in degrees, a multiple of 0.25.
+    - source (ERA5DataSource or str, optional): Backend to read from, see `as_data_source`
+      (defaults to the configured one, the ARCO ERA5 store on GCP unless overridden).
+    - read_stats (dict, optional): Filled with `bytes_read`, `chunks_read` and
+      `bytes_materialised` for the selection.
+    - concurrency (int, optional): Number of chunks fetched in parallel, defaults to
+      `FETCH_CONCURRENCY`. Use 1 for sequential reads.
+
+    Returns:
+    - ds_1deg (xr.Dataset): Downsampled dataset with selected variables and coordinates.
+    """
+    source = as_data_source(source)
+
     # Generate time steps every 12 hours starting from effective current date
     requested_times = pd.date_range(start=effective_current_date_obj, periods=2, freq='12h')
 
-    # Filter dataset to valid time range
-    ds = ds.sel(time=slice(ds.attrs['valid_time_start'], latest_time_str))
-    available_times = pd.to_datetime(ds.time.values)
-    valid_times = [t for t in requested_times if t in available_times]
+    # Keep the requested times available in the store (precomputed availability index)
+    valid_times = requested_times[source.availability().contains_many(requested_times)]
+
+    # Read the selection (load into memory), fetching chunks in parallel
+    concurrency = FETCH_CONCURRENCY if concurrency is None else concurrency
+    ds, stats = source.read_frames(valid_times, variables, levels, resolution, concurrency)
 
     # Rename latitude and longitude dimensions for consistency
     ds = ds.rename({'latitude': 'lat', 'longitude': 'lon'})
 
-    # Select pressure levels relevant for forecasting
-    levels = [50, 100, 150, 200, 250, 300, 400, 500, 600, 700, 850, 925, 1000]
-    ds = ds.sel(level=levels)
-
-    # Select relevant meteorological variables
-    variables = [
-        'land_sea_mask', 'geopotential_at_surface',
-        '2m_temperature', 'sea_surface_temperature', 'mean_sea_level_pressure',
-        '10m_v_component_of_wind', '10m_u_component_of_wind',
-        'u_component_of_wind', 'specific_humidity', 'temperature',
-        'vertical_velocity', 'v_component_of_wind', 'geopotential'
-    ]
-    ds = ds[variables]
-
-    # Select only the valid time steps
-    ds = ds.sel(time=valid_times)
-
     # Add a batch dimension for model compatibility
     ds = ds.expand_dims('batch')
 
@@ -101,48 +174,107 @@ def extract_arco_era5_data(user_current_date: str, user_target_date: str):
         'datetime': (('batch', 'time'), datetime_coord)
     })
 
-    # Compute the dataset (load into memory) and downsample to 1-degree resolution
-    ds = ds.compute()
-    ds_1deg = ds.isel(lat=slice(None, None, 4), lon=slice(None, None, 4))
-    ds_1deg = ds_1deg.sortby('lat')
+    ds_1deg = ds.sortby('lat')
+
+    stats['bytes_materialised'] = int(ds_1deg.nbytes)
+    print(f">>> ERA5 read: {stats['chunks_read']} chunks, {stats['bytes_read'] / 1e6:.1f} MB read, "
+          f"{stats['bytes_materialised'] / 1e6:.1f} MB materialised")
+    if read_stats is not None:
+        read_stats.update(stats)
+
+    return ds_1deg
+
+
+def extract_arco_era5_data(user_current_date: str, user_target_date: str, resolution=1.0,
+                           source=None, cache=None, today=None, read_stats=None):
+    """
+    Extracts ERA5 weather data from the ARCO public dataset on GCP for a given date range.
+    Applies lag logic to ensure compatibility with ERA5T data availability and prepares
+    the dataset for forecasting. Prepared slices are kept in a local on-disk cache, so a
+    repeated request for the same effective init date does not touch the network.
+
+    Parameters:
+    - user_current_date (str): The starting date for prediction (format: 'YYYY-MM-DD').
+    - user_target_date (str): The target date to predict towards (format: 'YYYY-MM-DD').
+    - resolution (float): Output grid spacing in degrees (1.0 for the 1x0 model).
+    - source (ERA5DataSource or str, optional): Backend to read from (defaults to the
+      configured one, the ARCO ERA5 store on GCP unless overridden).
+    - cache (DiskLRUCache, optional): Input slice cache, defaults to the process-wide one.
+    - today (datetime, optional): Reference "now" for the lag logic.
+    - read_stats (dict, optional): Filled with the read statistics of `load_era5_slice`
+      (left untouched on a cache hit).
+
+    Returns:
+    - ds_1deg (xr.Dataset): Downsampled dataset with selected variables and coordinates.
+    - nb_of_steps_to_perform (int): Number of prediction steps required.
+    """
+    effective_current_date_obj, nb_of_steps_to_perform = compute_effective_dates(
+        user_current_date, user_target_date, today=today)
+
+    ds_1deg = get_era5_slice(effective_current_date_obj, resolution, source, cache, read_stats)
 
     return ds_1deg, nb_of_steps_to_perform
 
 
+def get_era5_slice(effective_current_date_obj, resolution=1.0, source=None, cache=None, read_stats=None):
+    """
+    Returns the input slice of an effective init date from the input cache, reading
+    it from the ERA5 backend and caching it on a miss.
 
-def drop_time_dimensions_for_static_variables(input_1):
+    Parameters:
+    - effective_current_date_obj (datetime): Init date of the forecast (after lag logic).
+    - resolution (float): Output grid spacing in degrees.
+    - source (ERA5DataSource or str, optional): Backend to read from.
+    - cache (DiskLRUCache, optional): Input slice cache, defaults to the process-wide one.
+    - read_stats (dict, optional): Filled with the read statistics of `load_era5_slice`
+      (left untouched on a cache hit).
+
+    Returns:
+    - ds_1deg (xr.Dataset): Downsampled dataset with selected variables and coordinates.
     """
-    Removes the 'datetime' dimension from static variables in the dataset
-    to prepare them for merging with dynamic variables.
-    
+    cache = get_input_cache() if cache is None else cache
+    source = as_data_source(source)
+    key = input_cache_key(effective_current_date_obj, VARIABLES, LEVELS, resolution, source)
+
+    ds_1deg = cache.get(key)
+    if ds_1deg is not None:
+        print(f">>> ERA5 input cache hit for {effective_current_date_obj:%Y-%m-%d %H:%M}")
+        return ds_1deg
+
+    ds_1deg = load_era5_slice(effective_current_date_obj, VARIABLES, LEVELS, resolution, source,
+                              read_stats=read_stats)
+
+    # Only complete slices are cached, so a frame that becomes available later is not masked
+    if ds_1deg.sizes['time'] == 2:
+        cache.put(key, ds_1deg)
+
+    return ds_1deg
+
+
+
+def merge_static_fields(input_1, resolution=1.0, source=None):
+    """
+    Adds the static variables to the dataset from the process-wide static fields
+    store, without any network I/O once the store is loaded.
+
     Parameters:
-    input_1 (xr.Dataset): The input dataset containing both static and dynamic variables.
-    
+    input_1 (xr.Dataset): The input dataset containing the dynamic variables.
+    resolution (float): Grid spacing of the dataset, in degrees.
+    source (ERA5DataSource or str, optional): Backend the static fields are taken from
+        when not on disk yet (defaults to the configured one).
+
     Returns:
-    xr.Dataset: A dataset with static variables reduced and merged with dynamic variables.
+    xr.Dataset: A dataset with the static (lat, lon) variables merged with the dynamic variables.
     """
-    
-    # List of variables considered static (do not change over time)
-    static_vars = ['land_sea_mask', 'geopotential_at_surface']
-    
-    # Reduce static variables by selecting the first batch and time slice,
-    # then drop the 'datetime' dimension to make them truly static
-    ds_static_reduced = xr.Dataset({
-        var: input_1[var].isel(batch=0, time=0).squeeze().drop_vars('datetime')
-        for var in static_vars
-    })
-    
-    # Identify dynamic variables (all variables not in static_vars)
-    dynamic_vars = [var for var in input_1.data_vars if var not in static_vars]
-    ds_dynamic = input_1[dynamic_vars]
-    
-    # Merge static and dynamic datasets into a single dataset
-    input_1 = xr.merge([ds_static_reduced, ds_dynamic])
-    
+    static_fields = get_static_fields_store(source).get(resolution)
+
+    # The grids must match exactly, the static fields are never interpolated
+    input_1 = xr.merge([static_fields[STATIC_VARIABLES], input_1], join='exact', combine_attrs='drop_conflicts')
+
     return input_1
 
 
-def add_empty_total_precipitation_variable(input_1):
+def add_empty_total_precipitation_variable(input_1, dtype=INPUT_DTYPE):
     """
     Adds an empty 'total_precipitation_12hr' variable to the dataset.
     This is required for structural consistency, even though the model
@@ -150,6 +282,7 @@ def add_empty_total_precipitation_variable(input_1):
 
     Parameters:
     - input_1 (xr.Dataset): The input dataset to which the variable will be added.
+    - dtype (np.dtype): Floating point type of the variable (float32 by default).
 
     Returns:
     - xr.Dataset: The updated dataset with the new NaN-filled variable.
@@ -160,7 +293,8 @@ def add_empty_total_precipitation_variable(input_1):
         np.full(
             shape=(input_1.sizes['batch'], input_1.sizes['time'],
                    input_1.sizes['lat'], input_1.sizes['lon']),
-            fill_value=np.nan
+            fill_value=np.nan,
+            dtype=dtype
         ),
         dims=('batch', 'time', 'lat', 'lon'),
         coords={
@@ -176,13 +310,18 @@ def add_empty_total_precipitation_variable(input_1):
     input_1['total_precipitation_12hr'] = nan_precip
     return input_1
 
-def create_target_data(input_1,nb_of_steps_to_perform):
+def create_target_data(input_1, nb_of_steps_to_perform, dtype=INPUT_DTYPE):
     """
     Creates an empty target dataset, aligned with the model's expected output structure.
     The targets are filled with NaNs and span the forecast horizon defined by `nb_of_steps_to_perform`.
 
+    Each target variable is created once, as a single read-only NaN array broadcast
+    to its full (time, ...) shape, so no per-step copy of the state is made.
+
     Parameters:
     - input_1 (xr.Dataset): The input dataset used to infer shape and coordinate structure.
+    - nb_of_steps_to_perform (int): Number of 12-hour forecast steps.
+    - dtype (np.dtype): Floating point type of the targets (float32 by default).
 
     Returns:
     - eval_targets_test (xr.Dataset): A dataset with NaN-filled forecast targets and proper time/datetime coordinates.
@@ -209,19 +348,29 @@ def create_target_data(input_1,nb_of_steps_to_perform):
     )
 
     # Use the last time step of input_1 as a template for shape and variables
-    template = input_1.isel(time=-1).drop_vars("time")
-
-    # Create a list of NaN-filled copies of the template, one for each target time
-    eval_targets_test = xr.concat(
-        [template.expand_dims(time=[t]) * np.nan for t in target_time_coords],
-        dim="time"
-    )
+    template = input_1.isel(time=-1).drop_vars(["time", "datetime"])
+
+    # Broadcast a single NaN to the shape of every variable, with a leading time dimension
+    nan = np.array(np.nan, dtype=dtype)
+    data_vars = {
+        name: (
+            ("time",) + var.dims,
+            np.broadcast_to(nan, (nb_of_steps_to_perform,) + var.shape),
+            var.attrs,
+        )
+        for name, var in template.data_vars.items()
+    }
 
     # Assign the generated time and datetime coordinates
-    eval_targets_test = eval_targets_test.assign_coords({
-        "time": target_time_coords,
-        "datetime": ("time", target_datetime_coords)
-    })
+    eval_targets_test = xr.Dataset(
+        data_vars,
+        coords={
+            **template.coords,
+            "time": target_time_coords,
+            "datetime": ("time", target_datetime_coords),
+        },
+        attrs=template.attrs,
+    )
 
     return eval_targets_test
 
@@ -229,6 +378,8 @@ def combine_input_and_target(eval_targets_test, input_1):
     """
     Combines the input dataset and the empty target dataset into a single dataset.
     Static variables are preserved, while dynamic variables are concatenated along the time dimension.
+    The concatenation is the only copy of the data: the static variables are merged
+    without copying and the latitude sort is skipped when it is already ascending.
 
     Parameters:
     - eval_targets_test (xr.Dataset): The empty target dataset with future time steps.
@@ -238,8 +389,8 @@ def combine_input_and_target(eval_targets_test, input_1):
     - combined (xr.Dataset): A unified dataset containing both input and target data.
     """
 
-    # Define static variables that do not change over time
-    static_vars = ['land_sea_mask', 'geopotential_at_surface']
+    # Static variables do not change over time
+    static_vars = STATIC_VARIABLES
 
     # Remove static variables from both datasets before concatenation
     input_1_dynamic = input_1.drop_vars(static_vars)
@@ -254,31 +405,77 @@ def combine_input_and_target(eval_targets_test, input_1):
     # Merge static and dynamic variables into a single dataset
     combined = xr.merge([static_data, combined_dynamic])
 
-    # Sort the dataset by latitude for consistency
-    combined = combined.sortby('lat')
+    # Sort the dataset by latitude for consistency (sortby always copies, so only when needed)
+    if not combined.indexes['lat'].is_monotonic_increasing:
+        combined = combined.sortby('lat')
 
     return combined
 
-def get_input_data(current_date, target_date ):
+def get_input_data(current_date, target_date, source=None, resolution=1.0,
+                   dtype=INPUT_DTYPE, memory_report=None):
+    """
+    Assembles the model input (two past frames plus NaN targets) for a forecast request.
+
+    Parameters:
+    - current_date (str): The starting date for prediction (format: 'YYYY-MM-DD').
+    - target_date (str): The target date to predict towards (format: 'YYYY-MM-DD').
+    - source (ERA5DataSource or str, optional): ERA5 backend to read from (defaults to
+      the configured one, see `data_sources.get_data_source`).
+    - resolution (float): Grid spacing in degrees (1.0 for the 1x0 model).
+    - dtype (np.dtype): Floating point type kept through every step (float32 by default).
+    - memory_report (MemoryReport, optional): Collects the time and peak memory of each step.
+
+    Returns:
+    - combined (xr.Dataset): The dataset to give to the model.
+    """
+    effective_current_date_obj, nb_of_steps_to_perform = compute_effective_dates(current_date, target_date)
+    return assemble_input_data(effective_current_date_obj, nb_of_steps_to_perform, source=source,
+                               resolution=resolution, dtype=dtype, memory_report=memory_report)
+
+
+def assemble_input_data(effective_current_date_obj, nb_of_steps_to_perform, source=None, resolution=1.0,
+                        dtype=INPUT_DTYPE, memory_report=None):
+    """
+    Assembles the model input of an effective init date and rollout length, as computed
+    by `compute_effective_dates` (e.g. when the request was accepted).
 
-    # fetch data from the GCP Bucket for the selected dates
-    input_1, nb_of_steps_to_perform = extract_arco_era5_data(current_date, target_date)
+    Parameters:
+    - effective_current_date_obj (datetime): Init date of the forecast (after lag logic).
+    - nb_of_steps_to_perform (int): Number of prediction steps.
+    - source, resolution, dtype, memory_report: As in `get_input_data`.
 
-    # setting the last time value from the input as the starting time 0
-    input_1 = input_1.assign_coords(time=input_1.time - input_1.time[-1])
+    Returns:
+    - combined (xr.Dataset): The dataset to give to the model.
+    """
+    step = memory_report.step if memory_report is not None else (lambda name: contextlib.nullcontext())
 
-    # drop time dimentions for static variables
-    input_1 = drop_time_dimensions_for_static_variables(input_1)
+    # fetch data from the GCP Bucket (or the local input cache) for the effective init date
+    with step("fetch ERA5 slice"):
+        input_1 = get_era5_slice(effective_current_date_obj, resolution, source)
+        # the store is float32, so this is a no-op unless another dtype is requested
+        input_1 = input_1.astype(dtype, copy=False)
 
-    # the bucket data does not contain variable 'total_precipitation_12hr',
-    # the model does not use this varaible as input, but the data structure still requires it, creating ane emtpy variables 
-    input_1 = add_empty_total_precipitation_variable(input_1)
+    with step("prepare inputs"):
+        # setting the last time value from the input as the starting time 0
+        input_1 = input_1.assign_coords(time=input_1.time - input_1.time[-1])
+
+        # add the static variables (loaded once per process, not read from the bucket)
+        input_1 = merge_static_fields(input_1, resolution=resolution, source=source)
+
+        # the bucket data does not contain variable 'total_precipitation_12hr',
+        # the model does not use this varaible as input, but the data structure still requires it, creating ane emtpy variables 
+        input_1 = add_empty_total_precipitation_variable(input_1, dtype=dtype)
 
     # creating empty target dataset
-    eval_targets_test = create_target_data(input_1, nb_of_steps_to_perform)
+    with step("create target template"):
+        eval_targets_test = create_target_data(input_1, nb_of_steps_to_perform, dtype=dtype)
 
     # combining empty target dataset and input data to get the final replicated dataset to give to the model
-    combined = combine_input_and_target(eval_targets_test, input_1)
+    with step("combine input and target"):
+        combined = combine_input_and_target(eval_targets_test, input_1)
+
+    if memory_report is not None:
+        print(memory_report)
 
     return combined
 
@@ -0,0 +1,86 @@
+import contextlib
+import resource
+import time
+import tracemalloc
+
+
+def current_rss_mb() -> float:
+    """Current resident set size of the process, in MB (Linux only, 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1e6
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+
+def max_rss_mb() -> float:
+    """Peak resident set size of the process so far, in MB."""
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 / 1e6
+
+
+class MemoryReport:
+    """
+    Collects the duration and memory footprint of successive processing steps.
+
+    For every step the report records the peak of Python-traced allocations (numpy
+    buffers included) during the step, the memory still held at its end, and the
+    current and peak RSS of the process. Steps must not be nested.
+
+    tracemalloc traces every thread of the process, so the peaks are only those of the
+    step when nothing else allocates meanwhile: in the server, a single job worker.
+
+    Usage:
+        report = MemoryReport()
+        with report.step("fetch"):
+            ...
+        print(report)
+    """
+
+    def __init__(self, title: str = "memory report"):
+        self.title = title
+        self.steps = []
+
+    @contextlib.contextmanager
+    def step(self, name: str):
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        held_before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            held_after, peak = tracemalloc.get_traced_memory()
+            self.steps.append({
+                "step": name,
+                "seconds": time.perf_counter() - start,
+                "peak_mb": (peak - held_before) / 1e6,
+                "held_mb": (held_after - held_before) / 1e6,
+                "rss_mb": current_rss_mb(),
+                "max_rss_mb": max_rss_mb(),
+            })
+            if started_tracing:
+                tracemalloc.stop()
+
+    @property
+    def peak_mb(self) -> float:
+        return max((step["peak_mb"] for step in self.steps), default=0.0)
+
+    def format(self) -> str:
+        lines = [
+            f">>> {self.title}",
+            f"{'step':<28} | {'time (s)':>8} | {'peak (MB)':>9} | {'held (MB)':>9} | "
+            f"{'RSS (MB)':>8} | {'max RSS (MB)':>12}",
+        ]
+        for step in self.steps:
+            lines.append(
+                f"{step['step']:<28} | {step['seconds']:>8.2f} | {step['peak_mb']:>9.1f} | "
+                f"{step['held_mb']:>9.1f} | {step['rss_mb']:>8.1f} | {step['max_rss_mb']:>12.1f}"
+            )
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.format()
@@ -0,0 +1,104 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+# Index of a converted checkpoint: flat checkpoint key -> .npy file, and the source hash
+INDEX_FILE = "index.json"
+
+
+def is_mmap_checkpoint(path: str) -> bool:
+    """Whether `path` is a checkpoint directory written by `convert_checkpoint`."""
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+def read_index(directory: str) -> dict:
+    with open(os.path.join(directory, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def convert_checkpoint(npz_path: str, directory: str) -> dict:
+    """
+    Converts a GenCast `.npz` checkpoint (the flat `key -> array` layout written by
+    `graphcast.checkpoint.dump`) into a directory of uncompressed `.npy` files, one per
+    array, which `load_flat_checkpoint` memory-maps. The directory is written next to
+    its destination and renamed into place, so a reader never sees a partial checkpoint.
+
+    Parameters:
+    - npz_path (str): Source checkpoint.
+    - directory (str): Destination directory.
+
+    Returns:
+    - dict: The index of the converted checkpoint.
+    """
+    digest = hashlib.sha256()
+    with open(npz_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    tmp_dir = f"{directory.rstrip(os.sep)}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir)
+    index = {"source": os.path.basename(npz_path), "sha256": digest.hexdigest(), "arrays": {}}
+    with np.load(npz_path, allow_pickle=False) as flat:
+        for i, key in enumerate(flat.files):
+            filename = f"{i:05d}.npy"
+            np.save(os.path.join(tmp_dir, filename), flat[key], allow_pickle=False)
+            index["arrays"][key] = filename
+    with open(os.path.join(tmp_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f, indent=2)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.rename(tmp_dir, directory)
+    return index
+
+
+def load_flat_checkpoint(directory: str) -> dict:
+    """
+    Opens the arrays of a converted checkpoint as read-only memory maps: nothing is read
+    until an array is used, and the pages are shared through the page cache by every
+    process loading the same checkpoint. Strings and 0-d arrays are read directly.
+    """
+    flat = {}
+    for key, filename in read_index(directory)["arrays"].items():
+        array = np.load(os.path.join(directory, filename), mmap_mode="r", allow_pickle=False)
+        if array.ndim == 0 or array.dtype.kind in "US":
+            array = np.array(array)
+        flat[key] = array
+    return flat
+
+
+def load_checkpoint(directory: str, typ):
+    """
+    Loads a converted checkpoint as `typ` (e.g. `gencast.CheckPoint`), like
+    `graphcast.checkpoint.load` does for a `.npz`, with memory-mapped params.
+    """
+    from graphcast import checkpoint
+
+    return checkpoint._convert_types(typ, checkpoint._unflatten_checkpoint(load_flat_checkpoint(directory)))
+
+
+def load_any_checkpoint(path: str, typ):
+    """Loads a checkpoint as `typ`, from a converted directory or from a `.npz` file."""
+    from graphcast import checkpoint
+
+    if is_mmap_checkpoint(path):
+        return load_checkpoint(path, typ)
+    with open(path, "rb") as f:
+        return checkpoint.load(f, typ)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a GenCast .npz checkpoint into a memory-mappable directory.")
+    parser.add_argument("npz_path")
+    parser.add_argument("directory", nargs="?", help="Destination (default: the .npz path without extension)")
+    args = parser.parse_args()
+
+    directory = args.directory or os.path.splitext(args.npz_path)[0]
+    start = time.perf_counter()
+    index = convert_checkpoint(args.npz_path, directory)
+    print(f">>> Converted {len(index['arrays'])} arrays to {directory} in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,97 @@
+import dataclasses
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Jobs waiting between two stages; with 1, the inputs of the next job are assembled
+# while the current rollout runs, without holding more than one job ahead in memory
+PIPELINE_QUEUE_SIZE = int(os.environ.get("GENCAST_PIPELINE_QUEUE_SIZE", 1))
+
+# Worker threads of the input assembly (ERA5 fetch) and output (upload) stages
+FETCH_WORKERS = int(os.environ.get("GENCAST_FETCH_WORKERS", 1))
+OUTPUT_WORKERS = int(os.environ.get("GENCAST_OUTPUT_WORKERS", 1))
+
+
+@dataclasses.dataclass
+class Stage:
+    """
+    One stage of a `StagedExecutor`: `fn` takes the output of the previous stage (the
+    submitted item for the first one) and returns the input of the next one.
+    """
+
+    name: str
+    fn: object
+    workers: int = 1
+    busy_seconds: float = 0.0
+    items: int = 0
+
+
+class StagedExecutor:
+    """
+    Runs items through a sequence of stages, each on its own worker threads, with a
+    bounded queue in front of every stage. While a stage works on an item, the previous
+    stages already work on the next ones; a full queue blocks the stage feeding it, so
+    at most `queue_size` items wait between two stages.
+
+    Parameters:
+    - stages (list of Stage): The stages, in order.
+    - queue_size (int): Items waiting in front of each stage after the first.
+
+    Usage:
+        executor = StagedExecutor([Stage("fetch", fetch), Stage("rollout", rollout),
+                                   Stage("output", upload)]).start()
+        location = executor.submit(request).result()
+    """
+
+    def __init__(self, stages, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.stages = stages
+        # Submissions are not bounded, admission control is the job queue's
+        self._queues = [queue.Queue()] + [queue.Queue(maxsize=queue_size) for _ in stages[1:]]
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, item) -> Future:
+        """Queues an item, the returned future resolves to the output of the last stage."""
+        future = Future()
+        self._queues[0].put((item, future))
+        return future
+
+    def _work(self, index: int):
+        stage = self.stages[index]
+        while True:
+            item, future = self._queues[index].get()
+            start = time.perf_counter()
+            try:
+                item = stage.fn(item)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            finally:
+                with self._lock:
+                    stage.busy_seconds += time.perf_counter() - start
+                    stage.items += 1
+            if index + 1 < len(self.stages):
+                self._queues[index + 1].put((item, future))
+            else:
+                future.set_result(item)
+
+    def stats(self) -> dict:
+        """Items processed and busy seconds of every stage, and the queue lengths."""
+        with self._lock:
+            return {
+                stage.name: {"items": stage.items, "busy_seconds": stage.busy_seconds, "queued": q.qsize()}
+                for stage, q in zip(self.stages, self._queues)
+            }
+
+    def start(self):
+        """Starts the worker threads of every stage (daemons)."""
+        if not self._threads:
+            for index, stage in enumerate(self.stages):
+                for i in range(stage.workers):
+                    thread = threading.Thread(target=self._work, args=(index,), name=f"gencast-{stage.name}-{i}",
+                                              daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+        return self
@@ -0,0 +1,299 @@
+import argparse
+import dataclasses
+import json
+import math
+import os
+import time
+
+# Stored rollout timings of this instance type (see `calibrate`)
+TIMING_PROFILE_PATH = os.environ.get("GENCAST_TIMING_PROFILE", "/opt/ml/cache/timing_profile.json")
+
+# Largest ensemble of each product, the planner picks fewer members when the budget is tight
+PRODUCTS = {"fast": 2, "full": 8}
+DEFAULT_PRODUCT = "full"
+
+
+@dataclasses.dataclass
+class TimingProfile:
+    """
+    Measured rollout timings of a model on a device set.
+
+    Parameters:
+    - step_seconds (dict): Seconds per rollout step of one call of the forward function
+      (one sample per device), for every calibrated number of steps per chunk.
+    - overhead_seconds (float): Fixed cost of a forecast (input split, post-processing).
+    - num_devices (int): Number of devices the profile was measured on.
+    - resolution (float): Grid spacing of the model, in degrees.
+    """
+
+    step_seconds: dict
+    overhead_seconds: float = 0.0
+    num_devices: int = 1
+    resolution: float = 1.0
+
+    @classmethod
+    def load(cls, path: str = TIMING_PROFILE_PATH) -> "TimingProfile":
+        with open(path) as f:
+            profile = json.load(f)
+        profile["step_seconds"] = {int(chunk): seconds for chunk, seconds in profile["step_seconds"].items()}
+        return cls(**profile)
+
+    def save(self, path: str = TIMING_PROFILE_PATH) -> str:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(dataclasses.asdict(self), f, indent=2)
+        return path
+
+    def estimate(self, num_ensemble_members: int, num_steps: int, num_steps_per_chunk: int = 1,
+                 num_devices: int = None) -> float:
+        """
+        Estimated seconds of a rollout: every batch of one member per device (see
+        `shard_count`) runs all the steps, one call of the forward function per chunk.
+        """
+        num_devices = self.num_devices if num_devices is None else num_devices
+        batches = num_ensemble_members // shard_count(num_ensemble_members, num_devices)
+        return self.overhead_seconds + batches * num_steps * self.step_seconds[num_steps_per_chunk]
+
+
+def shard_count(num_ensemble_members: int, num_devices: int) -> int:
+    """
+    Number of devices an ensemble is spread over: the largest number of devices that
+    divides the ensemble size (see `resources.pmap_devices`).
+    """
+    return max(n for n in range(1, min(num_devices, num_ensemble_members) + 1) if num_ensemble_members % n == 0)
+
+
+def ensemble_sizes(product: str) -> list:
+    """Ensemble sizes the planner picks from for a product, largest first: the divisors of its size."""
+    return [n for n in range(PRODUCTS[product], 0, -1) if PRODUCTS[product] % n == 0]
+
+
+_timing_profile = None
+_timing_profile_loaded = False
+
+
+def get_timing_profile():
+    """
+    Returns the stored timing profile of the process, loaded once, or None when the
+    instance was not calibrated.
+    """
+    global _timing_profile, _timing_profile_loaded
+    if not _timing_profile_loaded:
+        _timing_profile_loaded = True
+        if os.path.exists(TIMING_PROFILE_PATH):
+            # A broken profile is a configuration problem of the instance, not of the
+            # requests: plan without one rather than refusing every request
+            try:
+                _timing_profile = TimingProfile.load(TIMING_PROFILE_PATH)
+            except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+                print(f">>> Ignoring the unreadable timing profile {TIMING_PROFILE_PATH}: {e!r}")
+    return _timing_profile
+
+
+@dataclasses.dataclass
+class RolloutPlan:
+    """Ensemble size, chunking and seed of one forecast, with its estimated duration."""
+
+    product: str
+    num_ensemble_members: int
+    num_steps_per_chunk: int = 1
+    seed: int = 0
+    estimated_seconds: float = None
+    fits_budget: bool = True
+
+    def predict_options(self) -> dict:
+        """Keyword arguments of `GenCastPredictor.predict`."""
+        return {
+            "num_ensemble_members": self.num_ensemble_members,
+            "num_steps_per_chunk": self.num_steps_per_chunk,
+            "seed": self.seed,
+        }
+
+
+def plan_rollout(num_steps: int, product: str = DEFAULT_PRODUCT, latency_budget_s: float = None,
+                 num_devices: int = None, profile: TimingProfile = None, seed: int = 0) -> RolloutPlan:
+    """
+    Picks the ensemble size and chunking of a forecast.
+
+    Without a budget (or a timing profile) the product's ensemble size is used. With both,
+    the largest ensemble of the product (see `ensemble_sizes`) that fits the budget is
+    picked, with its fastest calibrated chunking; if none fits, a single member is
+    returned with `fits_budget=False`. Members are spread over the largest number of
+    devices dividing the ensemble size (see `shard_count`).
+
+    Parameters:
+    - num_steps (int): Number of rollout steps of the forecast.
+    - product (str): "fast" or "full", see `PRODUCTS`.
+    - latency_budget_s (float, optional): Seconds available for the rollout.
+    - num_devices (int, optional): Number of devices, `jax.local_devices()` by default.
+    - profile (TimingProfile, optional): Timings, the stored profile by default.
+    - seed (int): Seed of the ensemble.
+
+    Returns:
+    - RolloutPlan: The plan.
+    """
+    if product not in PRODUCTS:
+        raise ValueError(f"Unknown product {product!r}, expected one of {sorted(PRODUCTS)}")
+    if num_devices is None:
+        import jax
+
+        num_devices = len(jax.local_devices())
+    profile = get_timing_profile() if profile is None else profile
+
+    max_members = PRODUCTS[product]
+    if profile is None:
+        return RolloutPlan(product, max_members, seed=seed)
+    if latency_budget_s is None:
+        # Unchunked rollouts can only be estimated if they were calibrated
+        estimated_seconds = None
+        if 1 in profile.step_seconds:
+            estimated_seconds = profile.estimate(max_members, num_steps, 1, num_devices)
+        return RolloutPlan(product, max_members, seed=seed, estimated_seconds=estimated_seconds)
+
+    for members in ensemble_sizes(product):
+        estimates = {chunk: profile.estimate(members, num_steps, chunk, num_devices)
+                     for chunk in profile.step_seconds if num_steps % chunk == 0}
+        if not estimates:
+            continue
+        chunk = min(estimates, key=estimates.get)
+        if estimates[chunk] <= latency_budget_s or members == 1:
+            return RolloutPlan(product, members, chunk, seed, estimates[chunk],
+                               fits_budget=estimates[chunk] <= latency_budget_s)
+    return RolloutPlan(product, 1, seed=seed, fits_budget=False)
+
+
+# Seeds are 32-bit unsigned integers, as taken by `jax.random.PRNGKey`
+MAX_SEED = 2 ** 32 - 1
+
+
+def _request_number(data: dict, field: str) -> float:
+    """Reads a numeric field of a request, raising ValueError if it is not one."""
+    value = data[field]
+    if not isinstance(value, bool):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+    raise ValueError(f"{field} must be a number, got {value!r}")
+
+
+def _request_int(data: dict, field: str) -> int:
+    """Reads an integer field of a request (e.g. 8, 8.0 or "8"), raising ValueError otherwise."""
+    value = data[field]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lstrip("+-").isdigit():
+        return int(value)
+    raise ValueError(f"{field} must be an integer, got {value!r}")
+
+
+def plan_from_request(data: dict, num_steps: int, num_devices: int = None) -> RolloutPlan:
+    """
+    Builds the plan of a forecast request. Optional request fields: "product" ("fast" or
+    "full"), "latencyBudgetSeconds", "seed", and "ensembleMembers" / "stepsPerChunk" to
+    override the planner.
+
+    Raises:
+    - ValueError: When a field is invalid: a budget that is not a positive number, a
+      seed that is not a 32-bit unsigned integer, an ensemble size that is not an
+      integer of at least 1, or a chunk size that does not divide the number of steps.
+    """
+    if num_devices is None:
+        import jax
+
+        num_devices = len(jax.local_devices())
+    latency_budget_s = None
+    if data.get("latencyBudgetSeconds") is not None:
+        latency_budget_s = _request_number(data, "latencyBudgetSeconds")
+        if not 0 < latency_budget_s < math.inf:
+            raise ValueError(f"latencyBudgetSeconds must be a positive number of seconds, got {latency_budget_s}")
+    seed = _request_int(data, "seed") if "seed" in data else 0
+    if not 0 <= seed <= MAX_SEED:
+        raise ValueError(f"seed must be between 0 and {MAX_SEED}, got {seed}")
+    plan = plan_rollout(
+        num_steps,
+        product=data.get("product", DEFAULT_PRODUCT),
+        latency_budget_s=latency_budget_s,
+        num_devices=num_devices,
+        seed=seed,
+    )
+    if "ensembleMembers" in data:
+        members = _request_int(data, "ensembleMembers")
+        if members < 1:
+            raise ValueError(f"ensembleMembers must be positive, got {members}")
+        plan.num_ensemble_members = members
+    if "stepsPerChunk" in data:
+        chunk = _request_int(data, "stepsPerChunk")
+        if chunk < 1 or num_steps % chunk:
+            raise ValueError(f"stepsPerChunk must divide the {num_steps} rollout steps, got {chunk}")
+        plan.num_steps_per_chunk = chunk
+    return plan
+
+
+def calibrate(predictor, chunk_sizes=(1,), num_steps: int = 2) -> TimingProfile:
+    """
+    Measures the timing profile of `predictor` on synthetic inputs: every chunk size is
+    compiled by a first rollout, then timed on a second one of one member per device.
+    Chunk sizes the model does not support are skipped.
+    """
+    import jax
+    from synthetic_era5 import make_synthetic_model_inputs
+
+    num_devices = len(jax.local_devices())
+    nb_steps = num_steps * max(chunk_sizes)
+    inputs = make_synthetic_model_inputs(nb_steps=nb_steps, resolution=predictor.resolution)
+
+    start = time.perf_counter()
+    eval_inputs, eval_targets, eval_forcings = predictor.extract_eval_data(inputs)
+    overhead_seconds = time.perf_counter() - start
+
+    step_seconds = {}
+    for chunk in chunk_sizes:
+        run = lambda: predictor.run_autoregression(  # noqa: E731
+            eval_inputs, eval_targets, eval_forcings,
+            num_ensemble_members=num_devices, num_steps_per_chunk=chunk)
+        try:
+            run()
+        except Exception as e:
+            print(f">>> {chunk} steps per chunk not supported: {e}")
+            continue
+        start = time.perf_counter()
+        run()
+        step_seconds[chunk] = (time.perf_counter() - start) / nb_steps
+        print(f">>> {chunk} steps per chunk: {step_seconds[chunk]:.2f} s per step")
+
+    return TimingProfile(step_seconds, overhead_seconds, num_devices, predictor.resolution)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the rollout timing profile, or print a plan.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    calibrate_parser = subparsers.add_parser("calibrate")
+    calibrate_parser.add_argument("--checkpoint", default="/opt/ml/model/GenCast_1p0deg_2019.npz")
+    calibrate_parser.add_argument("--resolution", type=float, default=1.0)
+    calibrate_parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[1])
+    calibrate_parser.add_argument("--output", default=TIMING_PROFILE_PATH)
+
+    plan_parser = subparsers.add_parser("plan")
+    plan_parser.add_argument("--steps", type=int, required=True)
+    plan_parser.add_argument("--product", default=DEFAULT_PRODUCT, choices=sorted(PRODUCTS))
+    plan_parser.add_argument("--budget-s", type=float, default=None)
+    plan_parser.add_argument("--devices", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        from cpu_devices import configure_from_env
+
+        configure_from_env()
+        from graphcast import checkpoint, gencast
+        from resources import GenCastPredictor
+
+        with open(args.checkpoint, "rb") as f:
+            ckpt = checkpoint.load(f, gencast.CheckPoint)
+        profile = calibrate(GenCastPredictor(ckpt, resolution=args.resolution), args.chunk_sizes)
+        print(f">>> Timing profile written to {profile.save(args.output)}")
+    else:
+        print(plan_rollout(args.steps, args.product, args.budget_s, args.devices))
@@ -0,0 +1,129 @@
+import argparse
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from data_sources import as_data_source, get_data_source
+from loading_API_data import apply_era5t_lag, get_era5_slice, get_input_cache, input_cache_key, LEVELS, VARIABLES
+
+# Set to 0 to disable the background prefetcher of the serving process
+PREFETCH_ENABLED = os.environ.get("ERA5_PREFETCH", "1") != "0"
+
+# Seconds between two checks of the store for new ERA5T frames
+PREFETCH_INTERVAL_SECONDS = float(os.environ.get("ERA5_PREFETCH_INTERVAL_SECONDS", 600))
+
+# Number of days ahead whose init dates are warmed, on top of today's
+PREFETCH_LOOKAHEAD_DAYS = int(os.environ.get("ERA5_PREFETCH_LOOKAHEAD_DAYS", 1))
+
+
+class ERA5Prefetcher:
+    """
+    Warms the ERA5 input cache ahead of demand.
+
+    Requests for recent dates are all mapped by the ERA5T lag logic to the same few
+    effective init dates. On every tick the prefetcher refreshes the store metadata and,
+    as soon as the frames of one of those init dates become available (a new
+    `valid_time_stop_era5t`), reads its input slice into the input cache, so the first
+    request of the day is served from local disk.
+
+    Parameters:
+    - source (ERA5DataSource or str, optional): Backend to read from (defaults to the
+      configured one).
+    - cache (DiskLRUCache, optional): Input slice cache, defaults to the process-wide one.
+    - resolution (float): Grid spacing of the slices, in degrees.
+    - interval (float): Seconds between two ticks of the background thread.
+    - lookahead_days (int): Days ahead whose init dates are warmed too.
+    - clock (callable): Returns the current `datetime`, injectable for tests.
+    """
+
+    def __init__(self, source=None, cache=None, resolution: float = 1.0,
+                 interval: float = PREFETCH_INTERVAL_SECONDS,
+                 lookahead_days: int = PREFETCH_LOOKAHEAD_DAYS, clock=datetime.today):
+        self.source = as_data_source(source)
+        self.cache = get_input_cache() if cache is None else cache
+        self.resolution = resolution
+        self.interval = interval
+        self.lookahead_days = lookahead_days
+        self.clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+
+    def candidate_inits(self, today=None) -> list:
+        """
+        Effective init dates that requests for today (and the lookahead days) map to.
+        """
+        today = self.clock() if today is None else today
+        midnight = datetime(today.year, today.month, today.day)
+        candidates = []
+        for day in range(self.lookahead_days + 1):
+            requested = midnight + timedelta(days=day)
+            effective = apply_era5t_lag(requested, today=today + timedelta(days=day))
+            if effective not in candidates:
+                candidates.append(effective)
+        return candidates
+
+    def run_once(self) -> list:
+        """
+        Refreshes the store metadata and warms every available candidate init date that
+        is not cached yet.
+
+        Returns:
+        - list: The init dates read into the cache during this tick.
+        """
+        if self.source.refresh():
+            print(f">>> Prefetcher: new ERA5T frames in {self.source}")
+
+        candidates = self.candidate_inits()
+        available = self.source.availability().available_inits(
+            np.array(candidates, dtype='datetime64[ns]'))
+
+        warmed = []
+        for init_time, is_available in zip(candidates, available):
+            key = input_cache_key(init_time, VARIABLES, LEVELS, self.resolution, self.source)
+            if not is_available or key in self.cache:
+                continue
+            print(f">>> Prefetcher: warming the input cache for {init_time:%Y-%m-%d %H:%M}")
+            get_era5_slice(init_time, self.resolution, self.source, self.cache)
+            warmed.append(init_time)
+        return warmed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                # A failed tick is retried on the next one, it must never stop serving
+                print(f">>> Prefetcher tick failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Starts the background thread (a daemon, so it never blocks shutdown)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="era5-prefetcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm the ERA5 input cache (sidecar mode).")
+    parser.add_argument("--source", default=None, help="ERA5 backend: arco, local or cds")
+    parser.add_argument("--path", default=None, help="Store URL or archive directory of the backend")
+    parser.add_argument("--resolution", type=float, default=1.0)
+    parser.add_argument("--interval", type=float, default=PREFETCH_INTERVAL_SECONDS)
+    parser.add_argument("--once", action="store_true", help="Run a single tick and exit")
+    args = parser.parse_args()
+
+    prefetcher = ERA5Prefetcher(get_data_source(args.source, args.path), resolution=args.resolution,
+                                interval=args.interval)
+    if args.once:
+        print(f">>> Warmed {len(prefetcher.run_once())} init date(s)")
+    else:
+        prefetcher._run()
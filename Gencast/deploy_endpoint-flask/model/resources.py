@@ -1,37 +1,41 @@
-# GraphCast modules
-import datatree 
+# GraphCast modules (only what the forward rollout needs)
 from graphcast import rollout
 from graphcast import xarray_jax
 from graphcast import normalization
-from graphcast import checkpoint
 from graphcast import data_utils
-from graphcast import xarray_tree
 from graphcast import gencast
-from graphcast import denoiser
 from graphcast import nan_cleaning
+from graphcast import denoiser
 
 # Standard libraries
+import contextlib
 import dataclasses
-import datetime
-import glob
-import math
 import os
-import zipfile
-from typing import Optional
+import time
 
 # Numerical and array operations
 import numpy as np
+import pandas as pd
 import xarray as xr
 import xarray
-from datatree import DataTree
 
-xr.DataTree = DataTree  # Patch xarray to include DataTree
+if not hasattr(xr, "DataTree"):
+    # Older xarray releases ship DataTree as a separate package
+    from datatree import DataTree
+
+    xr.DataTree = DataTree  # Patch xarray to include DataTree
 
 import jax
+import jax.numpy as jnp
 import haiku as hk
-import cdsapi
+import jmp
 import warnings
 
+from batching import stack_inputs
+from ensemble_stats import BatchEnsembleReducer, StreamingEnsembleReducer
+from planner import plan_rollout, shard_count
+from synthetic_era5 import make_synthetic_model_inputs
+
 warnings.filterwarnings("ignore")
 
 def process_predictions(predictions_1: xr.Dataset, input_1: xr.Dataset) -> xr.Dataset:
@@ -40,7 +44,8 @@ def process_predictions(predictions_1: xr.Dataset, input_1: xr.Dataset) -> xr.Da
     interpolating the target date to 1-hour intervals, and extending the forecast to 3 days.
 
     Parameters:
-    - predictions_1 (xr.Dataset): The raw model predictions with a 'sample' dimension.
+    - predictions_1 (xr.Dataset): The raw model predictions with a 'sample' dimension,
+      or their ensemble mean (see `StreamingEnsembleReducer`).
     - input_1 (xr.Dataset): The original input dataset used to derive datetime references.
     - output_path (str, optional): Path to save the final forecast as a NetCDF file.
 
@@ -48,8 +53,11 @@ def process_predictions(predictions_1: xr.Dataset, input_1: xr.Dataset) -> xr.Da
     - combined (xr.Dataset): The final processed forecast dataset.
     """
 
-    # Step 1: Average predictions across ensemble samples
-    mean_predictions_1 = predictions_1.mean(dim="sample")
+    # Step 1: Average predictions across ensemble samples (unless already reduced)
+    if "sample" in predictions_1.dims:
+        mean_predictions_1 = predictions_1.mean(dim="sample")
+    else:
+        mean_predictions_1 = predictions_1
 
     # Step 2: Assign datetime coordinates to the forecast
     start_datetime = input_1["datetime"].values[0, 0] + np.timedelta64(12, 'h')
@@ -79,149 +87,334 @@ def process_predictions(predictions_1: xr.Dataset, input_1: xr.Dataset) -> xr.Da
     return combined
 
 
-def gencast_predict(input_data, model):
-
-    STATS_DIR = "/opt/ml/code/stats"
-
-    # initialize the model
-    ckpt = model
-    denoiser_architecture_config = ckpt.denoiser_architecture_config
-    denoiser_architecture_config.sparse_transformer_config.attention_type = "triblockdiag_mha"
-    denoiser_architecture_config.sparse_transformer_config.mask_type = "full"
-
-    params = ckpt.params
-    state = {}
-
-    task_config = ckpt.task_config
-    sampler_config = ckpt.sampler_config
-    noise_config = ckpt.noise_config
-    noise_encoder_config = ckpt.noise_encoder_config
-    denoiser_architecture_config = ckpt.denoiser_architecture_config
-    print("Model description:\n", ckpt.description, "\n")
-    print("Model license:\n", ckpt.license, "\n")
-
-
-    # @title Extract training and eval data
-
-    eval_inputs, eval_targets, eval_forcings = data_utils.extract_inputs_targets_forcings(
-        input_data, target_lead_times=slice("12h", f"{(input_data.dims['time']-2)*12}h"), # All but 2 input frames.
-        **dataclasses.asdict(task_config))
-
-    # @title Load normalization data
-
-    with open(STATS_DIR +"/diffs_stddev_by_level.nc", "rb") as f:
-      diffs_stddev_by_level = xarray.load_dataset(f).compute()
-    with open(STATS_DIR +"/mean_by_level.nc", "rb") as f:
-      mean_by_level = xarray.load_dataset(f).compute()
-    with open(STATS_DIR +"/stddev_by_level.nc", "rb") as f:
-      stddev_by_level = xarray.load_dataset(f).compute()
-    with open(STATS_DIR +"/min_by_level.nc", "rb") as f:
-      min_by_level = xarray.load_dataset(f).compute()
-
-
-    # @title Build jitted functions, and possibly initialize random weights
-    def construct_wrapped_gencast():
-      """Constructs and wraps the GenCast Predictor."""
-      predictor = gencast.GenCast(
-          sampler_config=sampler_config,
-          task_config=task_config,
-          denoiser_architecture_config=denoiser_architecture_config,
-          noise_config=noise_config,
-          noise_encoder_config=noise_encoder_config,
-      )
-    
-      predictor = normalization.InputsAndResiduals(
-          predictor,
-          diffs_stddev_by_level=diffs_stddev_by_level,
-          mean_by_level=mean_by_level,
-          stddev_by_level=stddev_by_level,
-      )
-    
-      predictor = nan_cleaning.NaNCleaner(
-          predictor=predictor,
-          reintroduce_nans=True,
-          fill_value=min_by_level,
-          var_to_clean='sea_surface_temperature',
-      )
-    
-      return predictor
-    
-    
-    @hk.transform_with_state
-    def run_forward(inputs, targets_template, forcings):
-      predictor = construct_wrapped_gencast()
-      return predictor(inputs, targets_template=targets_template, forcings=forcings)
-    
-    
-    @hk.transform_with_state
-    def loss_fn(inputs, targets, forcings):
-      predictor = construct_wrapped_gencast()
-      loss, diagnostics = predictor.loss(inputs, targets, forcings)
-      return xarray_tree.map_structure(
-          lambda x: xarray_jax.unwrap_data(x.mean(), require_jax=True),
-          (loss, diagnostics),
-      )
-    
-    
-    def grads_fn(params, state, inputs, targets, forcings):
-      def _aux(params, state, i, t, f):
-        (loss, diagnostics), next_state = loss_fn.apply(
-            params, state, jax.random.PRNGKey(0), i, t, f
+# Lead times kept in the output: the target day (3 steps) and the two following days
+# (4 steps), see `process_predictions`
+OUTPUT_LEAD_TIMES = 7
+
+
+def output_window(inputs: xr.Dataset, num_lead_times: int = OUTPUT_LEAD_TIMES) -> tuple:
+    """
+    First and last lead time of the forecast output: the last `num_lead_times` target
+    steps of the assembled input dataset, or all of them for shorter rollouts (e.g. the
+    5 steps of a same-day request).
+    """
+    lead_times = inputs.indexes['time']
+    lead_times = lead_times[lead_times > pd.Timedelta(0)]
+    return lead_times[-min(num_lead_times, len(lead_times))], lead_times[-1]
+
+
+# Directory of the normalization statistics NetCDF files
+STATS_DIR = os.environ.get("GENCAST_STATS_DIR", "/opt/ml/code/stats")
+
+# Number of ensemble members sampled per forecast
+NUM_ENSEMBLE_MEMBERS = 8
+
+# Precision of the denoiser: "float32", or "bfloat16" / "float16" to store its params and
+# compute its activations in reduced precision (see `GenCastPredictor`)
+PRECISION = os.environ.get("GENCAST_PRECISION", "float32")
+PRECISIONS = {"float32": jnp.float32, "bfloat16": jnp.bfloat16, "float16": jnp.float16}
+
+
+def cast_params(params, dtype):
+    """Casts the floating point arrays of a params tree to `dtype`."""
+    return jax.tree_util.tree_map(
+        lambda x: x.astype(dtype) if jnp.issubdtype(x.dtype, jnp.floating) else x, params)
+
+
+def params_nbytes(params) -> int:
+    """Size of a params tree, in bytes."""
+    return sum(x.nbytes for x in jax.tree_util.tree_leaves(params))
+
+
+def pmap_devices(num_ensemble_members: int) -> list:
+    """
+    Devices an ensemble is spread over: the largest number of local devices that divides
+    the ensemble size (the rollout runs one sample per device at a time). On CPU, the
+    devices are the host devices exposed by `cpu_devices.configure_cpu_devices`.
+    """
+    devices = jax.local_devices()
+    return devices[:shard_count(num_ensemble_members, len(devices))]
+
+
+def load_normalization_stats(stats_dir: str = STATS_DIR) -> dict:
+    """
+    Loads the four normalization statistics datasets of GenCast into memory.
+
+    Parameters:
+    - stats_dir (str): Directory of the stats NetCDF files.
+
+    Returns:
+    - dict: `diffs_stddev_by_level`, `mean_by_level`, `stddev_by_level` and `min_by_level`.
+    """
+    stats = {}
+    for name in ("diffs_stddev_by_level", "mean_by_level", "stddev_by_level", "min_by_level"):
+        with open(os.path.join(stats_dir, f"{name}.nc"), "rb") as f:
+            stats[name] = xarray.load_dataset(f).compute()
+    return stats
+
+
+class GenCastPredictor:
+    """
+    Long-lived GenCast predictor built once from a checkpoint.
+
+    Holds the normalization statistics and the jitted and pmapped forward function (the
+    training-only loss and gradient functions are not built), so
+    that XLA compiles the model on the first forecast only and every later call of
+    `predict` reuses the compiled executables (shapes are the same across requests, the
+    rollout runs one step per chunk).
+
+    Parameters:
+    - ckpt (gencast.CheckPoint): Loaded GenCast checkpoint.
+    - stats_dir (str): Directory of the normalization statistics.
+    - num_ensemble_members (int): Number of ensemble members sampled per forecast.
+    - resolution (float): Grid spacing of the checkpoint, in degrees.
+    - precision (str): "float32", or "bfloat16" / "float16" to cast the params and run the
+      denoiser in reduced precision. The input normalization, the residual update and the
+      sampler stay in float32, as do the layer norms of the denoiser.
+    """
+
+    def __init__(self, ckpt, stats_dir: str = STATS_DIR, num_ensemble_members: int = NUM_ENSEMBLE_MEMBERS,
+                 resolution: float = 1.0, precision: str = PRECISION):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}, expected one of {sorted(PRECISIONS)}")
+        self.num_ensemble_members = num_ensemble_members
+        self.resolution = resolution
+        self.precision = precision
+        if precision != "float32":
+            # Keep only the cast params, the float32 ones are released with the checkpoint
+            ckpt = dataclasses.replace(ckpt, params=cast_params(ckpt.params, PRECISIONS[precision]))
+        self.ckpt = ckpt
+
+        # initialize the model
+        denoiser_architecture_config = ckpt.denoiser_architecture_config
+        denoiser_architecture_config.sparse_transformer_config.attention_type = "triblockdiag_mha"
+        denoiser_architecture_config.sparse_transformer_config.mask_type = "full"
+
+        self.params = ckpt.params
+        self.state = {}
+
+        self.task_config = ckpt.task_config
+        self.sampler_config = ckpt.sampler_config
+        self.noise_config = ckpt.noise_config
+        self.noise_encoder_config = ckpt.noise_encoder_config
+        self.denoiser_architecture_config = denoiser_architecture_config
+        print("Model description:\n", ckpt.description, "\n")
+        print("Model license:\n", ckpt.license, "\n")
+
+        # @title Load normalization data
+        self.stats = load_normalization_stats(stats_dir)
+
+        # @title Build jitted functions, once per process
+        params, state = self.params, self.state
+
+        @hk.transform_with_state
+        def run_forward(inputs, targets_template, forcings):
+            with self._precision_policy():
+                predictor = self._construct_wrapped_gencast()
+                return predictor(inputs, targets_template=targets_template, forcings=forcings)
+
+        self.run_forward_jitted = jax.jit(
+            lambda rng, i, t, f: run_forward.apply(params, state, rng, i, t, f)[0]
+        )
+        # We also produce a pmapped version for running in parallel.
+        self.run_forward_pmap = xarray_jax.pmap(self.run_forward_jitted, dim="sample")
+
+    def _precision_policy(self):
+        """
+        Haiku mixed precision policies of the reduced precision mode: the denoiser casts
+        its inputs to the reduced precision and its output back to float32, its layer
+        norms compute in float32.
+        """
+        stack = contextlib.ExitStack()
+        if self.precision != "float32":
+            dtype = PRECISIONS[self.precision]
+            stack.enter_context(hk.mixed_precision.push_policy(
+                denoiser.Denoiser, jmp.Policy(param_dtype=dtype, compute_dtype=dtype, output_dtype=jnp.float32)))
+            stack.enter_context(hk.mixed_precision.push_policy(
+                hk.LayerNorm, jmp.Policy(param_dtype=jnp.float32, compute_dtype=jnp.float32, output_dtype=dtype)))
+        return stack
+
+    def _construct_wrapped_gencast(self):
+        """Constructs and wraps the GenCast Predictor."""
+        predictor = gencast.GenCast(
+            sampler_config=self.sampler_config,
+            task_config=self.task_config,
+            denoiser_architecture_config=self.denoiser_architecture_config,
+            noise_config=self.noise_config,
+            noise_encoder_config=self.noise_encoder_config,
+        )
+
+        predictor = normalization.InputsAndResiduals(
+            predictor,
+            diffs_stddev_by_level=self.stats["diffs_stddev_by_level"],
+            mean_by_level=self.stats["mean_by_level"],
+            stddev_by_level=self.stats["stddev_by_level"],
+        )
+
+        predictor = nan_cleaning.NaNCleaner(
+            predictor=predictor,
+            reintroduce_nans=True,
+            fill_value=self.stats["min_by_level"],
+            var_to_clean='sea_surface_temperature',
         )
-        return loss, (diagnostics, next_state)
-    
-      (loss, (diagnostics, next_state)), grads = jax.value_and_grad(
-          _aux, has_aux=True
-      )(params, state, inputs, targets, forcings)
-      return loss, diagnostics, next_state, grads
-    
-    
-    loss_fn_jitted = jax.jit(
-        lambda rng, i, t, f: loss_fn.apply(params, state, rng, i, t, f)[0]
-    )
-    grads_fn_jitted = jax.jit(grads_fn)
-    run_forward_jitted = jax.jit(
-        lambda rng, i, t, f: run_forward.apply(params, state, rng, i, t, f)[0]
-    )
-    # We also produce a pmapped version for running in parallel.
-    run_forward_pmap = xarray_jax.pmap(run_forward_jitted, dim="sample")
-
-    # @title Autoregressive rollout (loop in python)
-    def run_autoregression(eval_inputs,eval_targets,eval_forcings):
+
+        return predictor
+
+    def extract_eval_data(self, inputs: xr.Dataset):
+        """
+        Splits an assembled input dataset into inputs, targets and forcings.
+        """
+        # @title Extract training and eval data
+        return data_utils.extract_inputs_targets_forcings(
+            inputs, target_lead_times=slice("12h", f"{(inputs.dims['time']-2)*12}h"), # All but 2 input frames.
+            **dataclasses.asdict(self.task_config))
+
+    def run_autoregression(self, eval_inputs, eval_targets, eval_forcings,
+                           num_ensemble_members: int = None,
+                           reducer: StreamingEnsembleReducer = None,
+                           num_steps_per_chunk: int = 1, seed: int = 0) -> StreamingEnsembleReducer:
+        """
+        Autoregressive rollout of the ensemble (loop in python).
+        Every chunk is folded into `reducer` as soon as it is produced, so the members
+        are never all held in memory.
+
+        Parameters:
+        - num_ensemble_members (int, optional): Overrides the ensemble size of the predictor,
+          spread over the devices of `pmap_devices`.
+        - reducer (StreamingEnsembleReducer, optional): Receives the chunks, a mean and
+          variance only reducer by default (a `BatchEnsembleReducer` for stacked requests).
+        - num_steps_per_chunk (int): Rollout steps per call of the forward function (each
+          chunk size is compiled once).
+        - seed (int): Seed of the ensemble; member i always uses the same key for a seed.
+
+        Returns:
+        - StreamingEnsembleReducer: The reducer, holding the ensemble statistics.
+        """
+        reducer = StreamingEnsembleReducer() if reducer is None else reducer
+        num_ensemble_members = self.num_ensemble_members if num_ensemble_members is None else num_ensemble_members
         print("Inputs:  ", eval_inputs.dims.mapping)
         print("Targets: ", eval_targets.dims.mapping)
         print("Forcings:", eval_forcings.dims.mapping)
-    
-        num_ensemble_members = 8 # @param ints
-        rng = jax.random.PRNGKey(0)
+
+        rng = jax.random.PRNGKey(seed)
         # We fold-in the ensemble member, this way the first N members should always
         # match across different runs which use take the same inputs
         # regardless of total ensemble size.
         rngs = np.stack(
             [jax.random.fold_in(rng, i) for i in range(num_ensemble_members)], axis=0)
-    
-        chunks = []
+
         for chunk in rollout.chunked_prediction_generator_multiple_runs(
             # Use pmapped version to parallelise across devices.
-            predictor_fn=run_forward_pmap,
+            predictor_fn=self.run_forward_pmap,
             rngs=rngs,
             inputs=eval_inputs,
             targets_template=eval_targets * np.nan,
             forcings=eval_forcings,
-            num_steps_per_chunk=1,
+            num_steps_per_chunk=num_steps_per_chunk,
             num_samples=num_ensemble_members,
-            pmap_devices=jax.local_devices()
+            pmap_devices=pmap_devices(num_ensemble_members)
             ):
-            chunks.append(chunk)
-        predictions = xarray.combine_by_coords(chunks)
-        return predictions
-    
-    # Run autoregression with pred_input_1
-    
-    print("-------autoregression 1----------------")
-    predictions_1 = run_autoregression(eval_inputs, eval_targets, eval_forcings)
+            reducer.update(chunk)
+        return reducer
+
+    def run_ensemble(self, inputs: xr.Dataset, reducer: StreamingEnsembleReducer = None,
+                     **rollout_options) -> StreamingEnsembleReducer:
+        """
+        Runs the ensemble rollout of an assembled input dataset and returns the reducer
+        holding its statistics (pass one with quantiles or `keep_members=True` for more
+        than the mean and variance). `rollout_options` are passed to `run_autoregression`.
+        """
+        eval_inputs, eval_targets, eval_forcings = self.extract_eval_data(inputs)
+
+        print("-------autoregression 1----------------")
+        return self.run_autoregression(eval_inputs, eval_targets, eval_forcings, reducer=reducer,
+                                       **rollout_options)
+
+    def predict(self, inputs: xr.Dataset, members_path: str = None, num_ensemble_members: int = None,
+                num_steps_per_chunk: int = 1, seed: int = 0) -> xr.Dataset:
+        """
+        Runs the ensemble forecast of an assembled input dataset (see `get_input_data`).
+
+        Parameters:
+        - inputs (xr.Dataset): Input frames followed by the NaN target template.
+        - members_path (str, optional): NetCDF file to write the raw ensemble members to.
+          The members are not kept otherwise.
+        - num_ensemble_members (int, optional): Ensemble size of this forecast (see `planner`).
+        - num_steps_per_chunk (int): Rollout steps per call of the forward function.
+        - seed (int): Seed of the ensemble.
+
+        Only the lead times of the output window (see `output_window`) are kept, earlier
+        steps are dropped from host memory as soon as the rollout produces them.
+
+        Returns:
+        - xr.Dataset: The processed forecast (see `process_predictions`).
+        """
+        with StreamingEnsembleReducer(keep_members=members_path is not None,
+                                      lead_time_window=output_window(inputs)) as reducer:
+            self.run_ensemble(inputs, reducer, num_ensemble_members=num_ensemble_members,
+                              num_steps_per_chunk=num_steps_per_chunk, seed=seed)
+            if members_path is not None:
+                reducer.write_members(members_path)
+            return process_predictions(reducer.mean(), inputs)
 
-    final_forecast = process_predictions(predictions_1, input_data)
+    def predict_batch(self, inputs_list, num_ensemble_members: int = None, num_steps_per_chunk: int = 1,
+                      seed: int = 0) -> list:
+        """
+        Runs the forecasts of several requests in a single rollout, stacked along `batch`
+        (see `stack_inputs`), and scatters the results back.
 
-    return final_forecast
+        Parameters:
+        - inputs_list (list of xr.Dataset): Assembled inputs of the requests.
+        - num_ensemble_members, num_steps_per_chunk, seed: As in `predict`, shared by the batch.
 
+        Returns:
+        - list of xr.Dataset: The processed forecast of every request, in order.
+        """
+        if len(inputs_list) == 1:
+            return [self.predict(inputs_list[0], num_ensemble_members=num_ensemble_members,
+                                 num_steps_per_chunk=num_steps_per_chunk, seed=seed)]
+
+        # Every request is reduced over its own output window only
+        windows = [output_window(inputs) for inputs in inputs_list]
+        with BatchEnsembleReducer(windows) as reducer:
+            self.run_ensemble(stack_inputs(inputs_list), reducer, num_ensemble_members=num_ensemble_members,
+                              num_steps_per_chunk=num_steps_per_chunk, seed=seed)
+            means = [request_reducer.mean() for request_reducer in reducer.reducers]
+
+        return [process_predictions(mean.drop_vars('batch', errors='ignore'), inputs)
+                for mean, inputs in zip(means, inputs_list)]
+
+    def warm_up(self, inputs: xr.Dataset = None, plan=None) -> float:
+        """
+        Compiles the forward function for the served shapes by running a one-chunk
+        rollout of one sample per device, with the devices and chunking of `plan`: the
+        planner's default plan (see `planner.plan_rollout`) unless given, so that the
+        executable of unplanned requests is the one compiled. Runs on synthetic inputs
+        unless `inputs` is given.
+        With the compilation cache enabled, the executables are loaded from disk instead.
+
+        Returns:
+        - float: Seconds taken.
+        """
+        start = time.perf_counter()
+        if plan is None:
+            plan = plan_rollout(1, num_devices=len(jax.local_devices()))
+        if inputs is None:
+            inputs = make_synthetic_model_inputs(nb_steps=plan.num_steps_per_chunk, resolution=self.resolution)
+        eval_inputs, eval_targets, eval_forcings = self.extract_eval_data(inputs)
+        self.run_autoregression(eval_inputs, eval_targets, eval_forcings,
+                                num_ensemble_members=len(pmap_devices(plan.num_ensemble_members)),
+                                num_steps_per_chunk=plan.num_steps_per_chunk)
+        seconds = time.perf_counter() - start
+        print(f">>> Model warm-up (compilation) for {plan} took {seconds:.1f} s")
+        return seconds
+
+
+def gencast_predict(input_data, model, **predict_options):
+    """
+    Runs a forecast with `model`, either a `GenCastPredictor` (reused as is) or a
+    checkpoint, from which a one-off predictor is built. `predict_options` are passed
+    to `GenCastPredictor.predict` (ensemble size, chunking, seed).
+    """
+    predictor = model if isinstance(model, GenCastPredictor) else GenCastPredictor(model)
+    return predictor.predict(input_data, **predict_options)
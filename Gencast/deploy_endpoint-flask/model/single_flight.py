@@ -0,0 +1,49 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the computation,
+    callers arriving while it is in flight wait for it and get the same result (or
+    exception). Once it finishes, the next call for the key runs again.
+
+    Usage:
+        flights = SingleFlight()
+        forecast = flights.do(key, lambda: run_forecast(request))
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Returns `fn()`, or the result of the in-flight call for `key` if there is one."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            print(f">>> Waiting for the in-flight computation of {str(key)[:12]}")
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def in_flight(self) -> int:
+        """Number of keys being computed."""
+        with self._lock:
+            return len(self._in_flight)
@@ -0,0 +1,119 @@
+import argparse
+import os
+import threading
+import uuid
+
+import numpy as np
+import xarray as xr
+
+from data_sources import ERA5DataSource, as_data_source, get_data_source
+from disk_cache import DiskLRUCache
+from era5_store import NATIVE_RESOLUTION
+
+# Variables considered static (do not change over time)
+STATIC_VARIABLES = ['land_sea_mask', 'geopotential_at_surface']
+
+# Grid spacings (in degrees) the static fields are pre-regridded to
+SUPPORTED_RESOLUTIONS = (0.25, 1.0)
+
+# Directory holding one NetCDF file of static fields per resolution
+STATIC_FIELDS_DIR = os.environ.get("GENCAST_STATIC_FIELDS_DIR", "/opt/ml/cache/static_fields")
+
+
+def resolution_tag(resolution: float) -> str:
+    """Formats a grid spacing like the GenCast checkpoint names (1.0 -> '1p0deg')."""
+    return f"{resolution:g}".replace(".", "p") + ("p0deg" if float(resolution).is_integer() else "deg")
+
+
+class StaticFieldsStore:
+    """
+    Process-level store of the static input fields (`land_sea_mask` and
+    `geopotential_at_surface`), pre-regridded for every supported resolution.
+
+    Fields are read from local NetCDF files; when a file is missing the fields are
+    fetched once from the ERA5 backend at native resolution, regridded to every
+    supported resolution and persisted, so later processes start without network I/O.
+
+    Parameters:
+    - directory (str): Directory of the `static_fields_<resolution>.nc` files.
+    - source (ERA5DataSource): Backend used when the local files are missing.
+    """
+
+    def __init__(self, directory: str, source: ERA5DataSource):
+        self.directory = directory
+        self.source = source
+        self._fields = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, resolution: float) -> str:
+        return os.path.join(self.directory, f"static_fields_{resolution_tag(resolution)}.nc")
+
+    def get(self, resolution: float = 1.0) -> xr.Dataset:
+        """
+        Returns the static fields on the (lat, lon) grid of `resolution`, with
+        ascending latitudes, loading or fetching them on first use.
+        """
+        with self._lock:
+            if resolution not in self._fields:
+                path = self.path_for(resolution)
+                if not os.path.exists(path):
+                    self._fetch_and_persist()
+                self._fields[resolution] = xr.load_dataset(path)
+            return self._fields[resolution]
+
+    def load_all(self):
+        """Loads the fields of every supported resolution (e.g. at process start)."""
+        for resolution in SUPPORTED_RESOLUTIONS:
+            self.get(resolution)
+
+    def _fetch_and_persist(self):
+        """Reads the fields once from the ERA5 store and writes every resolution to disk."""
+        print(f">>> Fetching static fields from {self.source}")
+        native = self.source.read_static(STATIC_VARIABLES)
+        native = native.rename({'latitude': 'lat', 'longitude': 'lon'})
+
+        os.makedirs(self.directory, exist_ok=True)
+        for resolution in SUPPORTED_RESOLUTIONS:
+            stride = int(round(resolution / NATIVE_RESOLUTION))
+            fields = native.isel(lat=slice(None, None, stride), lon=slice(None, None, stride)).sortby('lat')
+            fields = fields.astype(np.float32)
+            fields.attrs = {'resolution': resolution, 'source': self.source.cache_id}
+            path = self.path_for(resolution)
+            # Unique temporary file, so concurrent writers (e.g. two workers) never share one
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                fields.to_netcdf(tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+
+_static_fields_stores = {}
+_static_fields_stores_lock = threading.Lock()
+
+
+def get_static_fields_store(source=None) -> StaticFieldsStore:
+    """
+    Returns the process-wide static fields store of an ERA5 backend (the configured
+    one by default, see `as_data_source`). Fields of the ARCO backend live in
+    `STATIC_FIELDS_DIR`; other backends get a subdirectory of their own.
+    """
+    source = as_data_source(source)
+    with _static_fields_stores_lock:
+        if source.cache_id not in _static_fields_stores:
+            directory = STATIC_FIELDS_DIR
+            if source.name != 'arco':
+                directory = os.path.join(STATIC_FIELDS_DIR, DiskLRUCache.make_key(source=source.cache_id)[:16])
+            _static_fields_stores[source.cache_id] = StaticFieldsStore(directory, source)
+        return _static_fields_stores[source.cache_id]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-build the static fields files for every resolution.")
+    parser.add_argument("--output", default=STATIC_FIELDS_DIR)
+    parser.add_argument("--source", default=None, help="ERA5 backend: arco, local or cds")
+    parser.add_argument("--path", default=None, help="Store URL or archive directory of the backend")
+    args = parser.parse_args()
+    StaticFieldsStore(args.output, get_data_source(args.source, args.path)).load_all()
+    print(f">>> Static fields written to {args.output}")
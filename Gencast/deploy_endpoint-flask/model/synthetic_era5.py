@@ -0,0 +1,153 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Variables and levels in the layout of the ARCO ERA5 store
+SURFACE_VARIABLES = [
+    '2m_temperature', 'sea_surface_temperature', 'mean_sea_level_pressure',
+    '10m_v_component_of_wind', '10m_u_component_of_wind',
+]
+STATIC_VARIABLES = ['land_sea_mask', 'geopotential_at_surface']
+LEVEL_VARIABLES = [
+    'u_component_of_wind', 'specific_humidity', 'temperature',
+    'vertical_velocity', 'v_component_of_wind', 'geopotential',
+]
+GENCAST_LEVELS = [50, 100, 150, 200, 250, 300, 400, 500, 600, 700, 850, 925, 1000]
+
+
+def make_synthetic_era5(start: str, stop: str, n_lat: int = 17, n_lon: int = 32,
+                        levels=None, seed: int = 0, freq: str = '1h') -> xr.Dataset:
+    """
+    Builds a small in-memory dataset with the same layout as the ARCO ERA5 store
+    (hourly `time`, `level`, descending `latitude`, `longitude` and the dataset attrs
+    used for availability checks), filled with random float32 values.
+
+    Parameters:
+    - start (str): First hourly timestamp (e.g. '2019-03-01').
+    - stop (str): Last available day, written to the `valid_time_stop*` attrs.
+    - n_lat (int): Number of latitude points between 90 and -90.
+    - n_lon (int): Number of longitude points starting at 0.
+    - levels (list, optional): Pressure levels, defaults to the 13 levels used by GenCast.
+    - seed (int): Seed of the random generator.
+    - freq (str): Time step, hourly like ARCO; '12h' keeps only the 00/12 UTC frames the
+      loader reads, for full-size grids over many days.
+
+    Returns:
+    - ds (xr.Dataset): The synthetic ERA5 dataset.
+    """
+    levels = GENCAST_LEVELS if levels is None else levels
+    rng = np.random.default_rng(seed)
+
+    times = pd.date_range(start=start, end=pd.Timestamp(stop) + pd.Timedelta(hours=23), freq=freq)
+    coords = {
+        'time': times,
+        'level': np.array(levels, dtype=np.int64),
+        'latitude': np.linspace(90.0, -90.0, n_lat, dtype=np.float32),
+        'longitude': np.linspace(0.0, 360.0, n_lon, endpoint=False, dtype=np.float32),
+    }
+
+    data_vars = {}
+    for var in SURFACE_VARIABLES:
+        data_vars[var] = (('time', 'latitude', 'longitude'),
+                          rng.random((len(times), n_lat, n_lon), dtype=np.float32))
+    for var in STATIC_VARIABLES:
+        # Static fields are stored with a time dimension in ARCO as well
+        field = rng.random((n_lat, n_lon), dtype=np.float32)
+        data_vars[var] = (('time', 'latitude', 'longitude'),
+                          np.broadcast_to(field, (len(times), n_lat, n_lon)).copy())
+    for var in LEVEL_VARIABLES:
+        data_vars[var] = (('time', 'level', 'latitude', 'longitude'),
+                          rng.random((len(times), len(levels), n_lat, n_lon), dtype=np.float32))
+
+    ds = xr.Dataset(data_vars, coords=coords)
+    ds.attrs = {
+        'valid_time_start': str(pd.Timestamp(start).date()),
+        'valid_time_stop': str(pd.Timestamp(stop).date()),
+        'valid_time_stop_era5t': str(pd.Timestamp(stop).date()),
+    }
+    return ds
+
+
+def write_synthetic_era5(path: str, start: str, stop: str, **kwargs) -> str:
+    """
+    Writes a synthetic ERA5 dataset (see `make_synthetic_era5`) to a local Zarr store,
+    chunked one time step per chunk like the ARCO store, and returns its path.
+    """
+    ds = make_synthetic_era5(start, stop, **kwargs)
+    encoding = {var: {'chunks': (1,) + ds[var].shape[1:]} for var in ds.data_vars}
+    ds.to_zarr(path, mode='w', consolidated=True, encoding=encoding)
+    return path
+
+
+def write_synthetic_era5_netcdf(directory: str, start: str, stop: str, **kwargs) -> str:
+    """
+    Writes a synthetic ERA5 dataset (see `make_synthetic_era5`) as a local archive of
+    daily NetCDF files, readable by the `local` data source, and returns the directory.
+    """
+    ds = make_synthetic_era5(start, stop, **kwargs)
+    os.makedirs(directory, exist_ok=True)
+    for day, daily in ds.groupby('time.date'):
+        daily.to_netcdf(os.path.join(directory, f"era5_{day:%Y%m%d}.nc"))
+    return directory
+
+
+def make_synthetic_model_inputs(init_time: str = "2019-03-29", nb_steps: int = 1,
+                                resolution: float = 1.0, seed: int = 0) -> xr.Dataset:
+    """
+    Builds a complete model input (two frames, static fields, NaN target template of
+    `nb_steps` steps) with random values, in the layout and shapes `get_input_data`
+    produces at `resolution`. Used to compile the model without touching any store.
+
+    Parameters:
+    - init_time (str): Datetime of the first input frame.
+    - nb_steps (int): Number of target steps.
+    - resolution (float): Grid spacing in degrees.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - combined (xr.Dataset): The synthetic model input.
+    """
+    from loading_API_data import (INPUT_DTYPE, add_empty_total_precipitation_variable,
+                                  combine_input_and_target, create_target_data)
+
+    rng = np.random.default_rng(seed)
+    lat = np.linspace(-90.0, 90.0, int(round(180 / resolution)) + 1, dtype=np.float32)
+    lon = np.linspace(0.0, 360.0, int(round(360 / resolution)), endpoint=False, dtype=np.float32)
+    datetimes = pd.date_range(init_time, periods=2, freq='12h')
+
+    data_vars = {}
+    for var in SURFACE_VARIABLES:
+        data_vars[var] = (('batch', 'time', 'lat', 'lon'),
+                          rng.random((1, 2, len(lat), len(lon)), dtype=INPUT_DTYPE))
+    for var in LEVEL_VARIABLES:
+        data_vars[var] = (('batch', 'time', 'level', 'lat', 'lon'),
+                          rng.random((1, 2, len(GENCAST_LEVELS), len(lat), len(lon)), dtype=INPUT_DTYPE))
+    for var in STATIC_VARIABLES:
+        data_vars[var] = (('lat', 'lon'), rng.random((len(lat), len(lon)), dtype=INPUT_DTYPE))
+
+    input_1 = xr.Dataset(data_vars, coords={
+        'time': (datetimes - datetimes[-1]).to_numpy().astype('timedelta64[ns]'),
+        'datetime': (('batch', 'time'), datetimes.to_numpy().reshape(1, -1)),
+        'level': np.array(GENCAST_LEVELS, dtype=np.int64),
+        'lat': lat,
+        'lon': lon,
+    })
+    input_1 = add_empty_total_precipitation_variable(input_1)
+    return combine_input_and_target(create_target_data(input_1, nb_steps), input_1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic ARCO-layout ERA5 archive.")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["zarr", "netcdf"], default="zarr")
+    parser.add_argument("--start", default="2019-03-25")
+    parser.add_argument("--stop", default="2019-04-02")
+    parser.add_argument("--n-lat", type=int, default=17)
+    parser.add_argument("--n-lon", type=int, default=32)
+    args = parser.parse_args()
+    writer = write_synthetic_era5 if args.format == "zarr" else write_synthetic_era5_netcdf
+    writer(args.path, args.start, args.stop, n_lat=args.n_lat, n_lon=args.n_lon)
+    print(f">>> Synthetic ERA5 archive written to {args.path}")